@@ -10,6 +10,7 @@ from tools.reader import *
 from tasks.reachability import *
 from tasks.separators import *
 from tasks.simplify import *
+from tasks.solvers import setBackend
 
 
 def runReachability(path, log=False):
@@ -43,6 +44,21 @@ def runCoverability(path, log=False):
     print("--------------------------")
 
 
+def runCoverabilityMany(path, log=False):
+    net,bad_covers = parsePetriFile(path)
+    print("--Coverability checks-----")
+    print("Petri net:", path)
+    print("Number of places:", net.p)
+    print("Number of transitions:", net.t)
+    print("Number of targets:", len(bad_covers))
+    start = time.time()
+    for i,answer in enumerate(isCoverableMany(net, bad_covers, log=log)):
+        print("Target", i, "coverability output:", answer)
+    stop = time.time()
+    print("Check time:", stop-start)
+    print("--------------------------")
+
+
 def runSeparator(path, log=False):
     net = createNet(path+".lola")
     m = createMarking(net, path+".formula")
@@ -54,8 +70,8 @@ def runSeparator(path, log=False):
     nb_atomic_check = 0
     for clause in sep.clauses:
         for t in net.transitions:
-            nb_atomic_check += len(clause.forwardSyndrome[t.name][1])
-            nb_atomic_check += len(clause.backwardSyndrome[t.name][1])
+            nb_atomic_check += len(clause.forwardSyndrome[t.id][1])
+            nb_atomic_check += len(clause.backwardSyndrome[t.id][1])
     print("--Separator generation----")
     print("Petri net:", path)
     print("Number of places:", net.p)
@@ -65,6 +81,7 @@ def runSeparator(path, log=False):
     print("Syndrome check:", check[0])
     print("Number of atomic checks:", nb_atomic_check)
     print("Number of performed atomic checks:", check[2])
+    print("Implication cache hit rate:", check[3].hitRate())
     print("Generation time:", step-start)
     print("Syndrome check time:", stop-step)
     print("Paralelized syndrome check time:", check[1])
@@ -92,12 +109,13 @@ def runBenchmarkReachabilityInstances(path, log=False):
     nb_atomic_check = 0
     for clause in sep.clauses:
         for t in net.transitions:
-            nb_atomic_check += len(clause.forwardSyndrome[t.name][1])
-            nb_atomic_check += len(clause.backwardSyndrome[t.name][1])
+            nb_atomic_check += len(clause.forwardSyndrome[t.id][1])
+            nb_atomic_check += len(clause.backwardSyndrome[t.id][1])
     print("Separator size:", sep.getSize())
     print("Syndrome check:", check[0])
     print("Number of atomic checks:", nb_atomic_check)
     print("Number of performed atomic checks:", check[2])
+    print("Implication cache hit rate:", check[3].hitRate())
     print("Reachability check time:", step1-step0)
     print("Separator generation time:", step3-step2)
     print("Syndrome check time:", step4-step3)
@@ -128,12 +146,13 @@ def runBenchmarkCoverabilityInstances(path, log=False):
     nb_atomic_check = 0
     for clause in sep.clauses:
         for t in net.transitions:
-            nb_atomic_check += len(clause.forwardSyndrome[t.name][1])
-            nb_atomic_check += len(clause.backwardSyndrome[t.name][1])
+            nb_atomic_check += len(clause.forwardSyndrome[t.id][1])
+            nb_atomic_check += len(clause.backwardSyndrome[t.id][1])
     print("Separator size:", sep.getSize())
     print("Syndrome check:", check[0])
     print("Number of atomic checks:", nb_atomic_check)
     print("Number of performed atomic checks:", check[2])
+    print("Implication cache hit rate:", check[3].hitRate())
     print("Reachability check time:", step1-step0)
     print("Separator generation time:", step3-step2)
     print("Syndrome check time:", step4-step3)
@@ -141,6 +160,8 @@ def runBenchmarkCoverabilityInstances(path, log=False):
     print("--------------------------")
 
 
+# setBackend("highs") # LP backend of the run: "z3" (default, exact), "highs" (floating point heuristic) or "rational" (exact)
+
 # runBenchmarkReachabilityInstances("./nets/homemade/figure-1-esparza")
 # runBenchmarkReachabilityInstances("./nets/homemade/figure-1a-haddad")
 # runBenchmarkReachabilityInstances("./nets/homemade/mine-6")
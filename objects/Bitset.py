@@ -0,0 +1,80 @@
+import numpy as np
+
+
+class Bitset:
+    """
+    Class for subsets of places or transitions, given by their ids. The
+    set is a numpy bool array, so that set operations are vectorized.
+
+    Attributs:
+        bits: numpy bool array, bits[i] iff i is in the set
+    """
+    __slots__ = ("bits",)
+
+    def __init__(self, bits):
+        self.bits = np.asarray(bits, dtype=bool)
+
+    @classmethod
+    def empty(cls, n):
+        return cls(np.zeros(n, dtype=bool))
+
+    @classmethod
+    def full(cls, n):
+        return cls(np.ones(n, dtype=bool))
+
+    @classmethod
+    def fromIds(cls, n, ids):
+        bits = np.zeros(n, dtype=bool)
+        bits[np.asarray(ids, dtype=np.int64)] = True
+        return cls(bits)
+
+    def __repr__(self):
+        return "{" + ",".join(str(i) for i in self) + "}"
+
+    def __len__(self):
+        return int(np.count_nonzero(self.bits))
+
+    def __iter__(self):
+        return iter(self.ids().tolist())
+
+    def __contains__(self, i):
+        return bool(self.bits[i])
+
+    def __eq__(self, other):
+        return isinstance(other, Bitset) and np.array_equal(self.bits, other.bits)
+
+    def __or__(self, other):
+        return Bitset(self.bits | other.bits)
+
+    def __and__(self, other):
+        return Bitset(self.bits & other.bits)
+
+    def __sub__(self, other):
+        return Bitset(self.bits & ~other.bits)
+
+    def __le__(self, other):
+        return not np.any(self.bits & ~other.bits)
+
+    def ids(self):
+        """
+        Ids of the elements, in increasing order.
+        """
+        return np.flatnonzero(self.bits)
+
+    def copy(self):
+        return Bitset(self.bits.copy())
+
+    def complement(self):
+        return Bitset(~self.bits)
+
+    def union(self, other):
+        return self | other
+
+    def intersection(self, other):
+        return self & other
+
+    def difference(self, other):
+        return self - other
+
+    def issubset(self, other):
+        return self <= other
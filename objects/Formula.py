@@ -4,19 +4,135 @@ from z3 import *
 from objects.Net import Net
 
 
+SPARSE_DENSITY = 0.25 # maximal ratio of nonzero entries of a sparse atom vector
+
+
+class SparseVector:
+    """
+    Class for sparse vectors of atoms, given by the indices and the values 
+    of their nonzero entries. The vectors have the methods of numpy arrays 
+    used on atoms (dot, min, max and negation), so that an atom can hold 
+    either representation.
+
+    Attributs:
+        indices: numpy int array of the nonzero entries, in increasing order
+        values: numpy array of the values of the nonzero entries
+        n: dimension of the vector
+        entries: dictionary index->value of the nonzero entries, built by 
+            the first call to get
+    """
+    __slots__ = ("indices", "values", "n", "entries")
+
+    def __init__(self, indices, values, n):
+        self.indices = indices
+        self.values = values
+        self.n = n
+        self.entries = None
+
+    @classmethod
+    def fromDense(cls, vect):
+        vect = np.asarray(vect)
+        indices = np.flatnonzero(vect)
+        return cls(indices, vect[indices], len(vect))
+
+    def __repr__(self):
+        return str(self.toarray())
+
+    def __len__(self):
+        return self.n
+
+    def __neg__(self):
+        return SparseVector(self.indices, -self.values, self.n)
+
+    def dot(self, x):
+        return np.dot(self.values, np.asarray(x)[self.indices])
+
+    def get(self, i, default=0):
+        """
+        Value of the entry i, in constant time.
+        """
+        if self.entries is None:
+            self.entries = dict(zip(self.indices.tolist(), self.values.tolist()))
+        return self.entries.get(i, default)
+
+    def min(self):
+        if len(self.values)==self.n: return self.values.min()
+        return min(self.values.min(), 0) if len(self.values)>0 else 0
+
+    def max(self):
+        if len(self.values)==self.n: return self.values.max()
+        return max(self.values.max(), 0) if len(self.values)>0 else 0
+
+    def toarray(self):
+        vect = np.zeros(self.n, dtype=self.values.dtype)
+        vect[self.indices] = self.values
+        return vect
+
+
+def atomVector(vect):
+    """
+    Representation of a vector of an atom chosen by density: a SparseVector 
+    if at most SPARSE_DENSITY of its entries are nonzero, else a numpy array.
+    """
+    if isinstance(vect, SparseVector):
+        if len(vect.values)<=SPARSE_DENSITY*vect.n: return vect
+        return vect.toarray()
+    vect = np.asarray(vect)
+    if np.count_nonzero(vect)<=SPARSE_DENSITY*len(vect): return SparseVector.fromDense(vect)
+    return vect
+
+
+def denseVector(vect):
+    """
+    Numpy array of a vector of an atom.
+    """
+    return vect.toarray() if isinstance(vect, SparseVector) else vect
+
+
+def concatenateVectors(u, v):
+    """
+    Concatenation of two vectors of atoms, sparse if both are sparse.
+    """
+    if isinstance(u, SparseVector) and isinstance(v, SparseVector):
+        return SparseVector(np.concatenate((u.indices, v.indices+u.n)), 
+                            np.concatenate((u.values, v.values)), u.n+v.n)
+    return np.concatenate((denseVector(u), denseVector(v)))
+
+
+def alignedSupport(u, v):
+    """
+    Values of two vectors of atoms of the same dimension on the union of 
+    their supports (the entries where both are zero are left out).
+
+    Return:
+        uValues: numpy array of the values of u
+        vValues: numpy array of the values of v
+    """
+    if isinstance(u, SparseVector) and isinstance(v, SparseVector):
+        support = np.union1d(u.indices, v.indices)
+        uValues = np.zeros(len(support))
+        uValues[np.searchsorted(support, u.indices)] = u.values
+        vValues = np.zeros(len(support))
+        vValues[np.searchsorted(support, v.indices)] = v.values
+        return uValues, vValues
+    u, v = denseVector(u), denseVector(v)
+    support = (u!=0) | (v!=0)
+    return u[support], v[support]
+
+
 class Atom:
     """
     Class for atomic proposition of the form a*m<=ap*mp or a*m<ap*mp.
 
     Attributs:
-        a: numpy array
-        ap: numpy array
+        a: numpy array, or SparseVector if sparse (see atomVector)
+        ap: numpy array, or SparseVector if sparse (see atomVector)
         strict: True iff strict atom
     """
 
     def __init__(self, a, ap, strict=False):
-        self.a = a
-        self.ap = ap
+        self.a = atomVector(a)
+        self.ap = atomVector(ap)
         self.strict = strict
     
     def __repr__(self):
@@ -27,9 +143,141 @@ class Atom:
 
     def check(self, m, mp):
         if self.strict:
-            return np.dot(self.a,m)<np.dot(self.ap,mp)
+            return self.a.dot(m)<self.ap.dot(mp)
         else:
-            return np.dot(self.a,m)<=np.dot(self.ap,mp)
+            return self.a.dot(m)<=self.ap.dot(mp)
+
+    def key(self):
+        """
+        Hashable key of the atom, equal for structurally equal atoms.
+        """
+        return (self.strict, vectorKey(self.a), vectorKey(self.ap))
+
+
+def vectorKey(vect):
+    """
+    Hashable key of a vector of an atom (dimension, nonzero entries and 
+    their values), independent of the representation.
+    """
+    if not isinstance(vect, SparseVector): vect = SparseVector.fromDense(vect)
+    return (vect.n, vect.indices.astype(np.int64).tobytes(), vect.values.astype(float).tobytes())
+
+
+class AtomPool:
+    """
+    Class for the pool of the atoms of formulas, in which structurally equal 
+    atoms have a single id (hash-consing). The clauses of a formula hold ids 
+    of its pool, so that a shared atom is stored and evaluated once.
+
+    Attributs:
+        atoms: list of the atoms, indexed by id
+        ids: dictionary key of an atom->id
+    """
+
+    def __init__(self):
+        self.atoms = []
+        self.ids = dict()
+
+    def __len__(self):
+        return len(self.atoms)
+
+    def __getitem__(self, i):
+        return self.atoms[i]
+
+    def add(self, atom):
+        """
+        Id of an atom, which is added to the pool if no structurally equal 
+        atom is in it.
+        """
+        key = atom.key()
+        i = self.ids.get(key)
+        if i is None:
+            i = len(self.atoms)
+            self.atoms.append(atom)
+            self.ids[key] = i
+        return i
+
+    def addAll(self, atoms):
+        """
+        Numpy array of the ids of a list of atoms.
+        """
+        return np.array([self.add(atom) for atom in atoms], dtype=np.int64)
+
+
+class Syndrome:
+    """
+    Class for the syndrome of a clause in one direction (forward or 
+    backward): for the transition of id t, the clause implies the clause of 
+    id target[t], the j-th atom of which is implied by the atom maps[t][j] 
+    of the clause. The atom maps are read-only numpy arrays shared between 
+    transitions and clauses, and a syndrome is not modified once assigned, 
+    so that the forward and backward syndromes of a clause can be the same 
+    object.
+
+    Attributs:
+        target: numpy int array of the target clause ids (-1 if unassigned)
+        maps: numpy object array of the atom maps (None if unassigned)
+    """
+    __slots__ = ("target", "maps")
+
+    progressions = dict() # key: (start,size,step), value: shared atom map
+
+    def __init__(self, n):
+        self.target = np.full(n, -1, dtype=np.int64)
+        self.maps = np.full(n, None, dtype=object)
+
+    @classmethod
+    def uniform(cls, n, target, atoms):
+        """
+        Syndrome giving (target,atoms) for all the n transitions.
+        """
+        syndrome = cls(n)
+        syndrome.assign(np.arange(n), target, atoms)
+        return syndrome
+
+    @classmethod
+    def progression(cls, start, size, step=1):
+        """
+        Shared atom map [start, start+step, ..., start+(size-1)*step]: the 
+        identity map of a clause for (0,size), the constant map for step=0.
+        """
+        key = (start, size, step)
+        if key not in cls.progressions:
+            atoms = start + step*np.arange(size, dtype=np.int64)
+            atoms.flags.writeable = False
+            cls.progressions[key] = atoms
+        return cls.progressions[key]
+
+    def __getitem__(self, t):
+        return int(self.target[t]), self.maps[t]
+
+    def __len__(self):
+        return len(self.target)
+
+    def copy(self):
+        syndrome = Syndrome(0)
+        syndrome.target = self.target.copy()
+        syndrome.maps = self.maps.copy()
+        return syndrome
+
+    def assign(self, ids, target, atoms):
+        """
+        Assigns the syndrome of the transitions of ids.
+
+        Args:
+            ids: array of transition ids
+            target: clause id, or array of clause ids (one for each id)
+            atoms: atom map, or list of atom maps (one for each id)
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        self.target[ids] = target
+        if isinstance(atoms, list):
+            for t,a in zip(ids.tolist(), atoms):
+                self.maps[t] = a
+        else:
+            shared = np.empty(1, dtype=object)
+            shared[0] = atoms
+            self.maps[ids] = shared
 
 
 class Clause:
@@ -39,37 +287,62 @@ class Clause:
     Attributs:
         size: number of atoms
         id: index of the clause in the formula
-        atoms: array of atoms
-        forwardSyndrome: forward syndrome
+        pool: the atom pool of the clause
+        ids: numpy int array of the ids of the atoms in the pool
+        atoms: list of atoms (read from the pool)
+        forwardSyndrome: forward syndrome (Syndrome object)
         forwardSyndromeIH: forward induction hypothesis
-        backwardSyndrome: backward syndrome
+        backwardSyndrome: backward syndrome (Syndrome object)
         backwardSyndromeIH: backward induction hypothesis
     """
 
-    def __init__(self, atoms, id):
-        self.size = len(atoms)
+    def __init__(self, atoms, id, pool=None):
+        self.pool = AtomPool() if pool is None else pool
+        self.ids = self.pool.addAll(atoms)
+        self.size = len(self.ids)
         self.id = id
-        self.atoms = atoms
-        self.forwardSyndrome = dict()
+        self.forwardSyndrome = None
         self.forwardSyndromeIH = None
-        self.backwardSyndrome = dict()
+        self.backwardSyndrome = None
         self.backwardSyndromeIH = None
+
+    @classmethod
+    def fromIds(cls, ids, id, pool):
+        """
+        Clause of the atoms of given ids in the pool.
+        """
+        clause = cls([], id, pool)
+        clause.ids = np.asarray(ids, dtype=np.int64)
+        clause.size = len(clause.ids)
+        return clause
+
+    @property
+    def atoms(self):
+        return [self.pool.atoms[i] for i in self.ids]
     
     def __repr__(self):
         text = ""
-        for i in range(len(self.atoms)):
-            text += str(self.atoms[i])
-            if i!=len(self.atoms)-1:
+        atoms = self.atoms
+        for i in range(len(atoms)):
+            text += str(atoms[i])
+            if i!=len(atoms)-1:
                 text += " AND "
         return text
     
     def addAtom(self, atom):
-        self.atoms.append(atom)
+        self.ids = np.append(self.ids, self.pool.add(atom))
         self.size += 1
 
-    def check(self, m, mp):
-        for atom in self.atoms:
-            if not atom.check(m,mp):
+    def check(self, m, mp, values=None):
+        """
+        Evaluates the clause, the truth values of the atoms being read from 
+        (and added to) the dictionary values (atom id->bool) if given.
+        """
+        if values is None: values = dict()
+        for i in self.ids.tolist():
+            if i not in values:
+                values[i] = self.pool.atoms[i].check(m,mp)
+            if not values[i]:
                 return False
         return True
 
@@ -83,12 +356,26 @@ class Formula:
         size: number of clauses
         clauses: array of clauses
         net: the net that the formula is refered to
+        pool: the atom pool of the clauses
     """
 
-    def __init__(self, net, clauses):
+    def __init__(self, net, clauses, pool=None):
         self.size = len(clauses)
         self.clauses = clauses
         self.net = net
+        if pool is None: pool = clauses[0].pool if len(clauses)>0 else AtomPool()
+        self.pool = pool
+        for clause in clauses:
+            self.share(clause)
+
+    def share(self, clause):
+        """
+        Moves the atoms of a clause with another pool to the pool of the 
+        formula.
+        """
+        if clause.pool is not self.pool:
+            clause.ids = self.pool.addAll(clause.atoms)
+            clause.pool = self.pool
     
     def print(self):
         for i in range(len(self.clauses)):
@@ -104,11 +391,13 @@ class Formula:
         return text
     
     def addClause(self, clause):
+        self.share(clause)
         self.clauses.append(clause)
         self.size += 1
 
     def check(self, m, mp):
+        values = dict() # key: atom id, value: truth value for (m,mp)
         for clause in self.clauses:
-            if clause.check(m,mp):
+            if clause.check(m,mp,values):
                 return True
         return False
\ No newline at end of file
@@ -1,30 +1,119 @@
+from collections import OrderedDict
+from fractions import Fraction
+from math import gcd, lcm
 import numpy as np
-from scipy.sparse import csr_matrix
+from scipy.sparse import csr_matrix, csc_matrix
 from z3 import *
+from objects.Bitset import Bitset
+
+TVECTOR_CACHE_SIZE = 4096
+
+
+def leftKernelBasis(A):
+    """
+    Computes a basis of the left kernel {y | y*A=0} of a sparse matrix, by 
+    fraction-free Gaussian elimination on the rows of A (in exact integer 
+    arithmetic, the rows being kept sparse).
+
+    Args:
+        A: a p*t matrix in CSR format with rational entries
+
+    Return:
+        Y: k*p matrix in CSR format whose rows are the basis (integer entries)
+    """
+    A = csr_matrix(A)
+    pivots = dict() # column -> (row, combination) whose leading column it is
+    basis = []
+    for i in range(A.shape[0]):
+        entries = [Fraction(float(a)) for a in A.data[A.indptr[i]:A.indptr[i+1]]]
+        scale = lcm(*[a.denominator for a in entries]) if len(entries)>0 else 1
+        row = {int(j): int(a*scale) for j,a in zip(A.indices[A.indptr[i]:A.indptr[i+1]], entries) if a!=0}
+        combination = {i: scale} # the row is scale times the row i of A
+        while len(row)>0:
+            column = next((j for j in row if j in pivots), None)
+            if column is None:
+                pivots[min(row)] = (row, combination)
+                break
+            prow, pcombination = pivots[column]
+            a, b = row[column], prow[column]
+            row = eliminate(row, prow, a, b)
+            combination = eliminate(combination, pcombination, a, b)
+            g = gcd(*row.values(), *combination.values())
+            if g>1:
+                row = {j: c//g for j,c in row.items()}
+                combination = {j: c//g for j,c in combination.items()}
+        if len(row)==0:
+            basis.append(combination)
+    data, indices, indptr = [], [], [0]
+    for y in basis:
+        for j in sorted(y):
+            indices.append(j)
+            data.append(float(y[j]))
+        indptr.append(len(indices))
+    return csr_matrix((data, indices, indptr), shape=(len(basis), A.shape[0]))
+
+
+def eliminate(row, prow, a, b):
+    """
+    Computes b*row-a*prow for sparse integer rows given as dictionaries.
+    """
+    result = {j: b*c for j,c in row.items()}
+    for j, c in prow.items():
+        value = result.get(j, 0) - a*c
+        if value==0: result.pop(j, None)
+        else: result[j] = value
+    return result
 
 
 class Place:
     """
-    Class for places.
+    Class for places, as a view on the arrays of the net.
 
     Attributs:
+        net: the net of the place
         id: id of the place
         name: name of the place
         tokens: numbe rof tokens in the place
         preset: preset of the place
         postset: postset of the place
     """
+    __slots__ = ("net", "id")
 
-    def __init__(self, id, name, tokens):
+    def __init__(self, net, id):
+        self.net = net
         self.id = id
-        self.name = name
-        self.tokens = tokens
-        self.preset = set()
-        self.postset = set()
-    
+
     def __repr__(self):
         return self.name + ":" + str(self.id) + "(" + str(self.tokens) + ")"
 
+    def __eq__(self, other):
+        return isinstance(other, Place) and self.id == other.id and self.net is other.net
+
+    def __hash__(self):
+        return self.id
+
+    @property
+    def name(self):
+        return self.net.placeNames[self.id]
+
+    @property
+    def tokens(self):
+        return self.net.tokens[self.id]
+
+    @tokens.setter
+    def tokens(self, value):
+        self.net.tokens[self.id] = value
+
+    @property
+    def preset(self):
+        transitions = self.net.transitionList
+        return set(transitions[i] for i in self.net.pPreset(self.id))
+
+    @property
+    def postset(self):
+        transitions = self.net.transitionList
+        return set(transitions[i] for i in self.net.pPostset(self.id))
+
 
 class InArc:
     """
@@ -41,7 +130,7 @@ class InArc:
 
     def isEnabled(self, alpha):
         return self.place.tokens >= alpha*self.weight
-    
+
     def use(self, alpha):
         self.place.tokens -= alpha*self.weight
 
@@ -58,16 +147,17 @@ class OutArc:
     def __init__(self, place, weight):
         self.weight = weight
         self.place = place
-    
+
     def use(self, alpha):
         self.place.tokens += alpha*self.weight
 
 
 class Transition:
     """
-    Class for transitions.
+    Class for transitions, as a view on the arrays of the net.
 
     Attributs:
+        net: the net of the transition
         id: id of the transition
         name: name of the transition
         preset: preset of the transition
@@ -75,67 +165,203 @@ class Transition:
         inArcs: set of incoming arcs
         outArcs: set of outcoming arcs
     """
+    __slots__ = ("net", "id")
 
-    def __init__(self, id, name, inArcs, outArcs):
+    def __init__(self, net, id):
+        self.net = net
         self.id = id
-        self.name = name
-        self.preset = set()
-        self.postset = set()
-        self.inArcs = inArcs
-        self.outArcs = outArcs
-        for inArc in inArcs:
-            self.preset.add(inArc.place)
-            inArc.place.postset.add(self)
-        for outArc in outArcs:
-            self.postset.add(outArc.place)
-            outArc.place.preset.add(self)
 
     def __repr__(self):
-        # line = "[" + self.name + ":" + str(self.id) + "]["
-        # for inArc in self.inArcs:
-        #     line += inArc.place.name + ":" + str(inArc.place.id) + "(" + str(inArc.weight) + ") "
-        # line = line[:-1] + "]["
-        # for outArc in self.outArcs:
-        #     line += outArc.place.name + ":" + str(outArc.place.id) + "(" + str(outArc.weight) + ") "
-        # line = line[:-1] + "]"
-        # return line
         return self.name + ":" + str(self.id)
-    
+
+    def __eq__(self, other):
+        return isinstance(other, Transition) and self.id == other.id and self.net is other.net
+
+    def __hash__(self):
+        return self.id
+
+    @property
+    def name(self):
+        return self.net.transitionNames[self.id]
+
+    @property
+    def preset(self):
+        places = self.net.places
+        return set(places[i] for i in self.net.tPreset(self.id))
+
+    @property
+    def postset(self):
+        places = self.net.places
+        return set(places[i] for i in self.net.tPostset(self.id))
+
+    @property
+    def inArcs(self):
+        places = self.net.places
+        pre = self.net.pre
+        arcs = range(pre.indptr[self.id], pre.indptr[self.id+1])
+        return set(InArc(places[pre.indices[j]], pre.data[j]) for j in arcs)
+
+    @property
+    def outArcs(self):
+        places = self.net.places
+        post = self.net.post
+        arcs = range(post.indptr[self.id], post.indptr[self.id+1])
+        return set(OutArc(places[post.indices[j]], post.data[j]) for j in arcs)
+
     def fire(self, alpha):
-        enabled = all(inArc.isEnabled(alpha) for inArc in self.inArcs)
+        inArcs = self.inArcs
+        enabled = all(inArc.isEnabled(alpha) for inArc in inArcs)
         if enabled:
-            for inArc in self.inArcs: inArc.use(alpha)
+            for inArc in inArcs: inArc.use(alpha)
             for outArc in self.outArcs: outArc.use(alpha)
         return enabled
 
 
 class Net:
     """
-    Class for continuous Petri Net.
+    Class for continuous Petri Net. Places and transitions are integer
+    indices, and the arcs are stored as sparse p*t weight matrices: in
+    CSC format (column t gives °t and t°) and in CSR format (row p gives
+    p° and °p).
 
     Attributs:
         name: name of the Petri net
         p: number of places
         t: number of transitions
-        places: array of places
-        transitions: set of transitions
+        placeNames: array of place names, indexed by place id
+        transitionNames: array of transition names, indexed by transition id
+        pre: incoming arc weights in CSC format
+        post: outgoing arc weights in CSC format
+        preCsr: incoming arc weights in CSR format
+        postCsr: outgoing arc weights in CSR format
+        incidence: incidence matrix post-pre in CSC format
+        incidenceCsr: incidence matrix in CSR format
+        incidenceTranspose: transpose of the incidence matrix in CSR format
         marking: initial marking
+        tokens: current tokens of the places, changed by Transition.fire
         placeIds: dictionary place.name->place.id
         transitionIds: dictionary transition.name->transition.id
+        places: array of place views (built on first access)
+        transitions: set of transition views (built on first access)
+        transitionList: array of transition views, indexed by transition id
+        placeInvariants: basis of the P-semiflows (built on first access)
     """
 
-    def __init__(self, name, places, transitions, marking, placeIds, transitionIds):
+    def __init__(self, name, placeNames, transitionNames, marking, pre, post):
         self.name = name
-        self.p = len(places)
-        self.t = len(transitions)
-        self.places = places
-        self.transitions = transitions
+        self.p = len(placeNames)
+        self.t = len(transitionNames)
+        self.placeNames = placeNames
+        self.transitionNames = transitionNames
+        self.pre = csc_matrix(pre, shape=(self.p,self.t))
+        self.post = csc_matrix(post, shape=(self.p,self.t))
+        self.pre.sum_duplicates()
+        self.post.sum_duplicates()
+        self.preCsr = self.pre.tocsr()
+        self.postCsr = self.post.tocsr()
+        self.incidence = csc_matrix(self.post - self.pre)
+        self.incidence.eliminate_zeros()
+        self.incidenceCsr = self.incidence.tocsr()
+        self.incidenceTranspose = csr_matrix(self.incidence.transpose())
         self.marking = marking
-        self.placeIds = placeIds
-        self.transitionIds = transitionIds
-        self.size = 0
-        for t in transitions:
-            self.size += len(t.inArcs)+len(t.outArcs)
+        self.tokens = np.array(marking, dtype=float)
+        self.placeIds = {placeNames[i]: i for i in range(self.p)}
+        self.transitionIds = {transitionNames[i]: i for i in range(self.t)}
+        self.size = self.pre.nnz + self.post.nnz
+        self._places = None
+        self._transitionList = None
+        self._transitions = None
+        self._tVectors = OrderedDict()
+        self._placeInvariants = None
+
+    @classmethod
+    def fromArcs(cls, name, placeNames, transitionNames, marking, pre, post):
+        """
+        Constructs a net from arc triplets, as produced by the readers.
+
+        Args:
+            name: name of the Petri net
+            placeNames: array of place names, indexed by place id
+            transitionNames: array of transition names, indexed by transition id
+            marking: initial marking
+            pre: triplet (place ids, transition ids, weights) of incoming arcs
+            post: triplet (place ids, transition ids, weights) of outgoing arcs
+
+        Return:
+            net: the Petri net as a Net object
+        """
+        shape = (len(placeNames), len(transitionNames))
+        pre = csc_matrix((pre[2], (pre[0], pre[1])), shape=shape)
+        post = csc_matrix((post[2], (post[0], post[1])), shape=shape)
+        return cls(name, placeNames, transitionNames, marking, pre, post)
+
+    @property
+    def places(self):
+        if self._places is None:
+            self._places = [Place(self, i) for i in range(self.p)]
+        return self._places
+
+    @property
+    def transitionList(self):
+        if self._transitionList is None:
+            self._transitionList = [Transition(self, i) for i in range(self.t)]
+        return self._transitionList
+
+    @property
+    def transitions(self):
+        if self._transitions is None:
+            self._transitions = set(self.transitionList)
+        return self._transitions
+
+    @property
+    def placeInvariants(self):
+        """
+        Basis of the P-semiflows y*C=0 (integer rows of a CSR matrix), 
+        computed on first access.
+        """
+        if self._placeInvariants is None:
+            self._placeInvariants = leftKernelBasis(self.incidenceCsr)
+        return self._placeInvariants
+
+    def separatingInvariant(self, b):
+        """
+        Looks for a place invariant y such that y*b!=0, where b=m-m0 for a 
+        target marking m (then m is not reachable).
+
+        Args:
+            b: a place vector
+
+        Return:
+            y: the invariant as a dense vector, or None
+        """
+        Y = self.placeInvariants
+        i = np.flatnonzero(Y.dot(np.asarray(b, dtype=float))!=0)
+        if len(i)==0: return None
+        return Y[i[0]].toarray()[0]
+
+    def tPreset(self, t):
+        """
+        Ids of the places of °t.
+        """
+        return self.pre.indices[self.pre.indptr[t]:self.pre.indptr[t+1]]
+
+    def tPostset(self, t):
+        """
+        Ids of the places of t°.
+        """
+        return self.post.indices[self.post.indptr[t]:self.post.indptr[t+1]]
+
+    def pPreset(self, p):
+        """
+        Ids of the transitions of °p.
+        """
+        return self.postCsr.indices[self.postCsr.indptr[p]:self.postCsr.indptr[p+1]]
+
+    def pPostset(self, p):
+        """
+        Ids of the transitions of p°.
+        """
+        return self.preCsr.indices[self.preCsr.indptr[p]:self.preCsr.indptr[p+1]]
 
     def print(self):
         print("------------------------------------")
@@ -143,11 +369,11 @@ class Net:
         print("Places:")
         print(self.places)
         print("Transitions:")
-        for transition in self.transitions:
+        for transition in self.transitionList:
             print(transition)
         print("------------------------------------")
 
-        
+
     def supportMarking(self, m):
         """
         Compute the support of a marking.
@@ -156,9 +382,9 @@ class Net:
             m: a marking
         
         Return:
-            set: support of m (set of places)
+            Bitset: support of m (bitset of places)
         """
-        return set([x for x in self.places if m[x.id]>0])
+        return Bitset(np.asarray(m)>0)
     
     def supportTransitionVector(self, v):
         """
@@ -168,9 +394,71 @@ class Net:
             v: a transition vector
         
         Return:
-            set: support of v (set of transitions)
+            Bitset: support of v (bitset of transitions)
+        """
+        return Bitset(np.asarray(v)>0)
+
+    def transitionBits(self, T):
+        """
+        Converts a set of transitions into a bitset (bitsets are kept as is).
+        """
+        if isinstance(T, Bitset): return T
+        return Bitset.fromIds(self.t, [t.id for t in T])
+
+    def placeBits(self, P):
+        """
+        Converts a set of places into a bitset (bitsets are kept as is).
+        """
+        if isinstance(P, Bitset): return P
+        return Bitset.fromIds(self.p, [p.id for p in P])
+
+    def tSetPreset(self, T):
+        """
+        Compute the preset of a set of transitions.
+
+        Args:
+            T: a bitset of transitions
+
+        Return:
+            Bitset: °T (bitset of places)
+        """
+        return Bitset(self.pre.dot(T.bits.astype(float))>0)
+
+    def tSetPostset(self, T):
+        """
+        Compute the postset of a set of transitions.
+
+        Args:
+            T: a bitset of transitions
+
+        Return:
+            Bitset: T° (bitset of places)
         """
-        return set([x for x in self.transitions if v[x.id]>0])
+        return Bitset(self.post.dot(T.bits.astype(float))>0)
+
+    def pSetPreset(self, P):
+        """
+        Compute the preset of a set of places.
+
+        Args:
+            P: a bitset of places
+
+        Return:
+            Bitset: °P (bitset of transitions)
+        """
+        return Bitset(self.postCsr.transpose().dot(P.bits.astype(float))>0)
+
+    def pSetPostset(self, P):
+        """
+        Compute the postset of a set of places.
+
+        Args:
+            P: a bitset of places
+
+        Return:
+            Bitset: P° (bitset of transitions)
+        """
+        return Bitset(self.preCsr.transpose().dot(P.bits.astype(float))>0)
     
     def restriction(self, m, P):
         """
@@ -178,46 +466,68 @@ class Net:
 
         Args:
             m: a marking
-            P: a set of places
+            P: a set or a bitset of places
         
         Return:
             marking: marging m[P]
         """
-        marking = np.zeros(self.p)
-        for p in P:
-            marking[p.id] = m[p.id]
-        return marking
+        return np.where(self.placeBits(P).bits, m, 0.)
     
     def incidenceMatrix(self, Tp):
         """
-        Constructs the incidence matrix in CSR format restricted 
-        to a given set of transitions.
+        Gives the incidence matrix in CSR format restricted 
+        to a given set of transitions. The entries of the other 
+        transitions are masked out of the precomputed matrix.
 
         Args:
-            Tp: a set of transitions
+            Tp: a set or a bitset of transitions
 
         Return:
             C: restriction of incidence matrix to Tp
         """
-        C = np.zeros((self.p,self.t))
-        for t in Tp:
-            for outArc in t.outArcs:
-                C[outArc.place.id][t.id] += outArc.weight
-            for inArc in t.inArcs:
-                C[inArc.place.id][t.id] -= inArc.weight
-        return csr_matrix(C)
+        C = self.incidenceCsr
+        if len(Tp)==self.t: return C
+        keep = self.transitionBits(Tp).bits[C.indices]
+        indptr = np.concatenate(([0], np.cumsum(keep)))[C.indptr]
+        return csr_matrix((C.data[keep], C.indices[keep], indptr), shape=(self.p,self.t))
 
-    def tVectorPlus(self, t: Transition):
-        vect = np.zeros(self.p)
-        for arc in t.outArcs:
-            vect[arc.place.id] += arc.weight
+    def cachedTVector(self, kind, t, build):
+        """
+        Gives a per-transition vector from a bounded LRU cache.
+
+        Args:
+            kind: name of the vector
+            t: the transition id
+            build: function building the vector on a miss
+
+        Return:
+            vect: the (read-only) vector
+        """
+        key = (kind, t)
+        vect = self._tVectors.get(key)
+        if vect is None:
+            vect = build()
+            vect.flags.writeable = False
+            self._tVectors[key] = vect
+            if len(self._tVectors) > TVECTOR_CACHE_SIZE:
+                self._tVectors.popitem(last=False)
+        else:
+            self._tVectors.move_to_end(key)
         return vect
 
-    def tVectorMinus(self, t: Transition):
+    def columnToVector(self, A, t):
+        """
+        Converts the column t of a CSC matrix into a dense vector.
+        """
         vect = np.zeros(self.p)
-        for arc in t.inArcs:
-            vect[arc.place.id] += arc.weight
+        vect[A.indices[A.indptr[t]:A.indptr[t+1]]] = A.data[A.indptr[t]:A.indptr[t+1]]
         return vect
+
+    def tVectorPlus(self, t: Transition):
+        return self.cachedTVector("+", t.id, lambda: self.columnToVector(self.post, t.id))
+
+    def tVectorMinus(self, t: Transition):
+        return self.cachedTVector("-", t.id, lambda: self.columnToVector(self.pre, t.id))
     
     def tVector(self, t: Transition):
-        return self.tVectorPlus(t) - self.tVectorMinus(t)
\ No newline at end of file
+        return self.cachedTVector("", t.id, lambda: self.columnToVector(self.incidence, t.id))
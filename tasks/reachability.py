@@ -1,48 +1,117 @@
 import numpy as np
 import time
-from z3 import *
+from scipy.sparse import hstack, identity
 from tasks.utilities import *
+from tasks.solvers import newSystem, positivePool
 from objects.Net import Net
-
-EPS = 0.000000000001
+from objects.Bitset import Bitset
 
 
 def isFireable(net: Net, Tp, m, inv=False):
     """
     Decision algorithm for membership of firing set  (Algorithm 1 of [2]).
+    Each transition counts its input places that are not marked yet, and 
+    a place becoming marked decrements the counters of its consumers, so 
+    that every arc is visited once.
 
     Args:
         net: the net
-        Tp: the subset of transitions to check
+        Tp: the subset of transitions to check (bitset)
         m: a marking
         inv: True iff we check in the inverse net
 
     Return: 
         bool: True iff Tp is a firing set
-        Tpp: the maximal firing set included in Tp
+        Tpp: the maximal firing set included in Tp (bitset)
     """
-    Tpp = Tp.copy()
-    Pp = net.supportMarking(m)
-    while len(Tpp)>0:
-        new = False
-        removed = []
-        for t in Tpp:
-            if not inv:
-                if(t.preset.issubset(Pp)):
-                    removed.append(t)
-                    Pp = Pp.union(t.postset)
-                    new = True
-            else:
-                if(t.postset.issubset(Pp)):
-                    removed.append(t)
-                    Pp = Pp.union(t.preset)
-                    new = True
-        for t in removed: Tpp.remove(t)
-        if not new: return (False,Tp.difference(Tpp))
-    return (True,Tp.difference(Tpp))
+    # In the inverse net, °t and t° are swapped
+    inputs, outputs, consumers = (net.pre, net.post, net.preCsr) if not inv else (net.post, net.pre, net.postCsr)
+    marked = np.asarray(m)>0
+    unmarked = np.bincount(np.repeat(np.arange(net.t), np.diff(inputs.indptr)), 
+                           weights=~marked[inputs.indices], minlength=net.t).astype(np.int64)
+    inTp = Tp.bits
+    fired = np.zeros(net.t, dtype=bool)
+
+    out_indptr, out_indices = outputs.indptr.tolist(), outputs.indices.tolist()
+    cons_indptr, cons_indices = consumers.indptr.tolist(), consumers.indices.tolist()
+    marked, unmarked = marked.tolist(), unmarked.tolist()
+    stack = np.flatnonzero(inTp & (np.array(unmarked)==0)).tolist()
+    while len(stack)>0:
+        t = stack.pop()
+        fired[t] = True
+        for p in out_indices[out_indptr[t]:out_indptr[t+1]]:
+            if not marked[p]:
+                marked[p] = True
+                for u in cons_indices[cons_indptr[p]:cons_indptr[p+1]]:
+                    unmarked[u] -= 1
+                    if unmarked[u]==0 and inTp[u]: stack.append(u)
+
+    Tpp = Bitset(fired)
+    return (Tpp==Tp,Tpp)
+
+
+def isFireableMany(net: Net, Tp, M, inv=False):
+    """
+    Batched version of isFireable for several markings and the same subset 
+    of transitions. All the markings are processed together, one round of 
+    firing at a time.
+
+    Args:
+        net: the net
+        Tp: the subset of transitions to check (bitset)
+        M: a matrix whose rows are markings
+        inv: True iff we check in the inverse net
+
+    Return: 
+        list of pairs (bool, Tpp) as returned by isFireable, one per marking
+    """
+    inputs, outputs = (net.pre, net.post) if not inv else (net.post, net.pre)
+    marked = np.asarray(M).T>0
+    fired = np.zeros((net.t, marked.shape[1]), dtype=bool)
+    while True:
+        unmarked = inputs.transpose().dot((~marked).astype(float))
+        new = (unmarked==0) & ~fired & Tp.bits[:,None]
+        if not new.any(): break
+        fired |= new
+        marked |= outputs.dot(new.astype(float))>0
+    return [(Bitset(fired[:,i])==Tp,Bitset(fired[:,i])) for i in range(fired.shape[1])]
+
+
+def stateEquationCheck(net: Net, m, s=None, invariants=True):
+    """
+    Pre-check for reachability: m is not reachable if some place invariant 
+    y (y*C=0) has y*m!=y*m0, or if the state equation C*v==m-m0 has no 
+    solution v>=0 (then there is y with y*C>=0 and y*(m-m0)<0).
+
+    Args:
+        net: the net
+        m: the target marking
+        s: the system encoding C*v==m-m0 over v>=0, if it is already built
+        invariants: False to skip the place invariant test (when the 
+            caller already did it for a batch of targets)
+
+    Return: 
+        bool: False iff m is proved not reachable from net.marking
+        y: the separating vector if m is proved not reachable, else None
+    """
+    b = m-net.marking
+    if invariants:
+        y = net.separatingInvariant(b)
+        if y is not None: return False,y
+
+    if s is None:
+        s = newSystem(net.t)
+        s.addEq(net.incidenceCsr, b)
+    if s.check(): return True,None
+
+    Y = newSystem(net.p, nonnegative=False)
+    Y.addLe(-net.incidenceTranspose, np.zeros(net.t))
+    Y.addLt(b[None,:], [0])
+    assert Y.check(), "Error: the state equation has no Farkas certificate"
+    return False,Y.point()
 
 
-def isReachable(net: Net, m, log=False):
+def isReachable(net: Net, m, log=False, maxSupport=False, workers=None):
     """
     Decision algorithm for reachability (Algorithm 2 of [2]).
 
@@ -50,14 +119,76 @@ def isReachable(net: Net, m, log=False):
         net: the net
         m: the target marking
         log: True will print the avancement
+        maxSupport: True will compute the solution of maximal support with 
+            a few LP solves instead of one check per transition and place
+        workers: number of processes sharing the checks per transition 
+            and place (None for a sequential run)
 
     Return: 
         bool: True iff m is reachable from net.marking
     """
 
     if all(m[i]==net.marking[i] for i in range(net.p)): return True
-    
-    Tp = net.transitions.copy()
+
+    # One system for the whole call: variables v>=0 with C*v==m-m0
+    s = newSystem(net.t)
+    s.addEq(net.incidenceCsr, m-net.marking)
+    if not stateEquationCheck(net, m, s)[0]: return False
+    with positivePool(s, workers) as pool:
+        return reachabilityFixpoint(net, m, s, log, maxSupport, pool)
+
+
+def isReachableMany(net: Net, M, log=False, maxSupport=False, workers=None):
+    """
+    Decision algorithm for reachability of several target markings. The 
+    system C*v==m-m0 is encoded once for all the targets, only its 
+    right-hand side changes.
+
+    Args:
+        net: the net
+        M: a matrix whose rows are target markings
+        log: True will print the avancement
+        maxSupport: see isReachable
+        workers: see isReachable
+
+    Return: 
+        generator of the verdicts (bool, True iff the target is reachable 
+        from net.marking), one per target and in order
+    """
+    M = np.asarray(M, dtype=float).reshape((-1, net.p))
+    # Targets separated from m0 by a place invariant, all at once
+    separated = np.any(net.placeInvariants.dot((M-net.marking).T)!=0, axis=0)
+    s = newSystem(net.t)
+    s.addParametricEq(net.incidenceCsr)
+    for k, m in enumerate(M):
+        if all(m[i]==net.marking[i] for i in range(net.p)):
+            yield True
+            continue
+        if separated[k]:
+            yield False
+            continue
+        s.push()
+        s.setParameters(m-net.marking)
+        answer = stateEquationCheck(net, m, s, invariants=False)[0]
+        if answer:
+            with positivePool(s, workers) as pool:
+                answer = reachabilityFixpoint(net, m, s, log, maxSupport, pool)
+        s.pop()
+        yield answer
+
+
+def reachabilityFixpoint(net: Net, m, s, log=False, maxSupport=False, pool=None):
+    """
+    Fixpoint loop of isReachable, on a system s encoding C*v==m-m0 over 
+    v>=0. The transitions removed from Tp are fixed to zero in s as the 
+    loop goes, and pool is the PositivePool of s (None for a sequential 
+    run).
+
+    Return: 
+        bool: True iff m is reachable from net.marking
+    """
+    Tp = Bitset.full(net.t)
+    removed = Bitset.empty(net.t)
 
     count_while = 0
     while len(Tp)>0:
@@ -66,45 +197,44 @@ def isReachable(net: Net, m, log=False):
         nb_sol = 0
         sol = np.zeros(net.t)
 
-        s = Solver()
-        v = np.array([Real("v%i" % i) for i in range(net.t)])
-        positiveCstrt = [v[i]>=0 for i in range(net.t)]
-        C = net.incidenceMatrix(Tp)
-        CDotv = sparseDot(C,v)
-        mMinusm0 = m-net.marking
-        matrixCstrt = [CDotv[i] == mMinusm0[i] for i in range(net.p)]
-        s.add(positiveCstrt+matrixCstrt)
-
-        count_for = 0
-        avancement = 0
-        avancement_old = 0
+        s.fixZero(Tp.complement().difference(removed).ids())
+        removed = Tp.complement()
+
         if log: print(">Step "+ str(count_while))
-        for t in Tp:
-            count_for += 1
-            avancement = int(count_for/len(Tp)*100)
-            if log and (avancement-avancement_old>=5):
-                print(str(avancement)+"%")
-                avancement_old = avancement
-
-            s.push()
-            s.add(v[t.id]>0)
-
-            if s.check() == sat:
-                nb_sol += 1
-                model = s.model()
-                model_fraction = modelToFloat(model, v, "v")
-                sol += model_fraction
+        if maxSupport:
+            sol = s.maximalSupport()
+            if sol is None: return False
+        elif pool is not None:
+            points = pool.positiveChecks(Tp.ids(), removed.ids())
+            if len(points)==0: return False
+            sol = np.mean(points, axis=0)
+        else:
+            count_for = 0
+            avancement = 0
+            avancement_old = 0
+            for t in Tp:
+                count_for += 1
+                avancement = int(count_for/len(Tp)*100)
+                if log and (avancement-avancement_old>=5):
+                    print(str(avancement)+"%")
+                    avancement_old = avancement
+
+                if sol[t]>0: continue # already positive in a previous model
+
+                s.push()
+                s.addPositive(t)
+
+                if s.check():
+                    nb_sol += 1
+                    sol += s.point()
                 
-            s.pop()
+                s.pop()
 
-        if nb_sol==0: return False
-        else: sol /= nb_sol
+            if nb_sol==0: return False
+            else: sol /= nb_sol
 
         Tp = net.supportTransitionVector(sol)
-        oTpo = set()
-        for t in Tp:
-            oTpo = oTpo.union(t.preset)
-            oTpo = oTpo.union(t.postset)
+        oTpo = net.tSetPreset(Tp).union(net.tSetPostset(Tp))
             
         m0_oTpo = net.restriction(net.marking, oTpo)
         maxFS_m0 = isFireable(net, Tp, m0_oTpo)[1]
@@ -118,7 +248,7 @@ def isReachable(net: Net, m, log=False):
     return False
 
 
-def isCoverable(net: Net, m, log=False):
+def isCoverable(net: Net, m, log=False, maxSupport=False, workers=None):
     """
     Decision algorithm for coverability (Algorithm 3 of [2]).
 
@@ -126,14 +256,67 @@ def isCoverable(net: Net, m, log=False):
         net: the net
         m: the target marking
         log: True will print the avancement
+        maxSupport: True will compute the solution of maximal support with 
+            a few LP solves instead of one check per transition and place
+        workers: number of processes sharing the checks per transition 
+            and place (None for a sequential run)
 
     Return: 
         bool: True iff m is coverable from net.marking
     """
 
     if all(m[i]<=net.marking[i] for i in range(net.p)): return True
-    
-    Tp = net.transitions.copy()
+
+    # One system for the whole call: variables (v,w)>=0 with C*v-w==m-m0
+    s = newSystem(net.t+net.p)
+    s.addEq(hstack([net.incidenceCsr, -identity(net.p)]), m-net.marking)
+    with positivePool(s, workers) as pool:
+        return coverabilityFixpoint(net, m, s, log, maxSupport, pool)
+
+
+def isCoverableMany(net: Net, M, log=False, maxSupport=False, workers=None):
+    """
+    Decision algorithm for coverability of several target markings. The 
+    system C*v-w==m-m0 is encoded once for all the targets, only its 
+    right-hand side changes.
+
+    Args:
+        net: the net
+        M: a matrix whose rows are target markings
+        log: True will print the avancement
+        maxSupport: see isCoverable
+        workers: see isCoverable
+
+    Return: 
+        generator of the verdicts (bool, True iff the target is coverable 
+        from net.marking), one per target and in order
+    """
+    s = newSystem(net.t+net.p)
+    s.addParametricEq(hstack([net.incidenceCsr, -identity(net.p)]))
+    for m in np.asarray(M, dtype=float).reshape((-1, net.p)):
+        if all(m[i]<=net.marking[i] for i in range(net.p)):
+            yield True
+            continue
+        s.push()
+        s.setParameters(m-net.marking)
+        with positivePool(s, workers) as pool:
+            answer = coverabilityFixpoint(net, m, s, log, maxSupport, pool)
+        s.pop()
+        yield answer
+
+
+def coverabilityFixpoint(net: Net, m, s, log=False, maxSupport=False, pool=None):
+    """
+    Fixpoint loop of isCoverable, on a system s encoding C*v-w==m-m0 over 
+    (v,w)>=0. The transitions removed from Tp are fixed to zero in s as 
+    the loop goes, and pool is the PositivePool of s (None for a 
+    sequential run).
+
+    Return: 
+        bool: True iff m is coverable from net.marking
+    """
+    Tp = Bitset.full(net.t)
+    removed = Bitset.empty(net.t)
 
     count_while = 0
     while len(Tp)>0:
@@ -143,69 +326,68 @@ def isCoverable(net: Net, m, log=False):
         sol_v = np.zeros(net.t)
         sol_w = np.zeros(net.p)
 
-        s = Solver()
-        v = np.array([Real("v%i" % i) for i in range(net.t)])
-        w = np.array([Real("w%i" % i) for i in range(net.p)])
-        cstrt_positive_V = [v[i]>=0 for i in range(net.t)]
-        cstrt_positive_W = [w[i]>=0 for i in range(net.p)]
-        C = net.incidenceMatrix(Tp)
-        C_dot_v = sparseDot(C,v)
-        m_minus_m0 = m-net.marking
-        cstrt_matrix = [C_dot_v[i]-w[i] == m_minus_m0[i] for i in range(net.p)]
-        s.add(cstrt_positive_V+cstrt_positive_W+cstrt_matrix)
-
-        count_for = 0
-        avancement = 0
-        avancement_old = 0
+        s.fixZero(Tp.complement().difference(removed).ids())
+        removed = Tp.complement()
+
         if log: print(">Step "+ str(count_while))
-        for t in Tp:
-            count_for += 1
-            avancement = int(count_for/len(Tp)*100)
-            if log and (avancement-avancement_old>=5):
-                print(str(avancement)+"%")
-                avancement_old = avancement
-
-            s.push()
-            s.add(v[t.id]>0)
-
-            if s.check() == sat:
-                nb_sol += 1
-                model = s.model()
-                model_fraction_V = modelToFloat(model, v, "v")
-                model_fraction_W = modelToFloat(model, w, "w")
-                sol_v += model_fraction_V
-                sol_w += model_fraction_W
+        if maxSupport:
+            solution = s.maximalSupport()
+            if solution is None: return False
+            sol_v,sol_w = solution[:net.t],solution[net.t:]
+        elif pool is not None:
+            points = pool.positiveChecks(np.concatenate((Tp.ids(), net.t+np.arange(net.p))), removed.ids())
+            if len(points)==0: return False
+            solution = np.mean(points, axis=0)
+            sol_v,sol_w = solution[:net.t],solution[net.t:]
+        else:
+            count_for = 0
+            avancement = 0
+            avancement_old = 0
+            for t in Tp:
+                count_for += 1
+                avancement = int(count_for/len(Tp)*100)
+                if log and (avancement-avancement_old>=5):
+                    print(str(avancement)+"%")
+                    avancement_old = avancement
+
+                if sol_v[t]>0: continue # already positive in a previous model
+
+                s.push()
+                s.addPositive(t)
+
+                if s.check():
+                    nb_sol += 1
+                    point = s.point()
+                    sol_v += point[:net.t]
+                    sol_w += point[net.t:]
                 
-            s.pop()
-
-        count = 0
-        for p in net.places:
-            count += 1
-            if log: print("second step: "+str(round(count/net.p*100, 2))+"%")
-
-            s.push()
-            s.add(w[p.id]>0)
-
-            if s.check() == sat:
-                nb_sol += 1
-                model = s.model()
-                model_fraction_V = modelToFloat(model, v, "v")
-                model_fraction_W = modelToFloat(model, w, "w")
-                sol_v += model_fraction_V
-                sol_w += model_fraction_W
+                s.pop()
+
+            count = 0
+            for p in range(net.p):
+                count += 1
+                if log: print("second step: "+str(round(count/net.p*100, 2))+"%")
+
+                if sol_w[p]>0: continue # already positive in a previous model
+
+                s.push()
+                s.addPositive(net.t+p)
+
+                if s.check():
+                    nb_sol += 1
+                    point = s.point()
+                    sol_v += point[:net.t]
+                    sol_w += point[net.t:]
                 
-            s.pop()
+                s.pop()
 
-        if nb_sol==0: return False
-        else:
-            sol_v /= nb_sol
-            sol_w /= nb_sol
+            if nb_sol==0: return False
+            else:
+                sol_v /= nb_sol
+                sol_w /= nb_sol
 
         Tp = net.supportTransitionVector(sol_v)
-        oTpo = set()
-        for t in Tp:
-            oTpo = oTpo.union(t.preset)
-            oTpo = oTpo.union(t.postset)
+        oTpo = net.tSetPreset(Tp).union(net.tSetPostset(Tp))
             
         m0_oTpo = net.restriction(net.marking, oTpo)
         maxFS_m0 = isFireable(net, Tp, m0_oTpo)[1]
@@ -219,7 +401,7 @@ def isCoverable(net: Net, m, log=False):
     return False
 
 
-def createBadMarkingFromCoverabilityCheck(net: Net, m, log=False):
+def createBadMarkingFromCoverabilityCheck(net: Net, m, log=False, maxSupport=False, workers=None):
     """
     Decision algorithm for coverability (Algorithm 3 of [2]).
 
@@ -227,15 +409,38 @@ def createBadMarkingFromCoverabilityCheck(net: Net, m, log=False):
         net: the net
         m: the target marking
         log: True will print the avancement
+        maxSupport: True will compute the solution of maximal support with 
+            a few LP solves instead of one check per transition and place
+        workers: number of processes sharing the checks per transition 
+            and place (None for a sequential run)
 
     Return: 
         bool: True iff m is coverable from net.marking
     """
 
     if all(m[i]<=net.marking[i] for i in range(net.p)): return True,m+np.zeros(net.p)
-    
-    Tp = net.transitions.copy()
+
+    # One system for the whole call: variables (v,w)>=0 with C*v-w==m-m0
+    s = newSystem(net.t+net.p)
+    s.addEq(hstack([net.incidenceCsr, -identity(net.p)]), m-net.marking)
+    with positivePool(s, workers) as pool:
+        return badMarkingFixpoint(net, m, s, log, maxSupport, pool)
+
+
+def badMarkingFixpoint(net: Net, m, s, log=False, maxSupport=False, pool=None):
+    """
+    Fixpoint loop of createBadMarkingFromCoverabilityCheck, on a system s 
+    encoding C*v-w==m-m0 over (v,w)>=0. The transitions removed from Tp 
+    are fixed to zero in s as the loop goes, and pool is the PositivePool 
+    of s (None for a sequential run).
+
+    Return: 
+        bool: True iff m is coverable from net.marking
+        previous_m: the marking m+w of the last rejected solution (or -1)
+    """
+    Tp = Bitset.full(net.t)
     previous_m = -1
+    removed = Bitset.empty(net.t)
 
     count_while = 0
     while len(Tp)>0:
@@ -245,73 +450,72 @@ def createBadMarkingFromCoverabilityCheck(net: Net, m, log=False):
         sol_v = np.zeros(net.t)
         sol_w = np.zeros(net.p)
 
-        s = Solver()
-        v = np.array([Real("v%i" % i) for i in range(net.t)])
-        w = np.array([Real("w%i" % i) for i in range(net.p)])
-        cstrt_positive_V = [v[i]>=0 for i in range(net.t)]
-        cstrt_positive_W = [w[i]>=0 for i in range(net.p)]
-        C = net.incidenceMatrix(Tp)
-        C_dot_v = sparseDot(C,v)
-        m_minus_m0 = m-net.marking
-        cstrt_matrix = [C_dot_v[i]-w[i] == m_minus_m0[i] for i in range(net.p)]
-        s.add(cstrt_positive_V+cstrt_positive_W+cstrt_matrix)
-
-        count_for = 0
-        avancement = 0
-        avancement_old = 0
+        s.fixZero(Tp.complement().difference(removed).ids())
+        removed = Tp.complement()
+
         if log: print(">Step "+ str(count_while))
-        for t in Tp:
-            count_for += 1
-            avancement = int(count_for/len(Tp)*100)
-            if log and (avancement-avancement_old>=5):
-                print(str(avancement)+"%")
-                avancement_old = avancement
-
-            s.push()
-            s.add(v[t.id]>0)
-
-            if s.check() == sat:
-                nb_sol += 1
-                model = s.model()
-                model_fraction_V = modelToFloat(model, v, "v")
-                model_fraction_W = modelToFloat(model, w, "w")
-                sol_v += model_fraction_V
-                sol_w += model_fraction_W
+        if maxSupport:
+            solution = s.maximalSupport()
+            if solution is None: return False,previous_m
+            sol_v,sol_w = solution[:net.t],solution[net.t:]
+        elif pool is not None:
+            points = pool.positiveChecks(np.concatenate((Tp.ids(), net.t+np.arange(net.p))), removed.ids())
+            if len(points)==0: return False,previous_m
+            solution = np.mean(points, axis=0)
+            sol_v,sol_w = solution[:net.t],solution[net.t:]
+        else:
+            count_for = 0
+            avancement = 0
+            avancement_old = 0
+            for t in Tp:
+                count_for += 1
+                avancement = int(count_for/len(Tp)*100)
+                if log and (avancement-avancement_old>=5):
+                    print(str(avancement)+"%")
+                    avancement_old = avancement
+
+                if sol_v[t]>0: continue # already positive in a previous model
+
+                s.push()
+                s.addPositive(t)
+
+                if s.check():
+                    nb_sol += 1
+                    point = s.point()
+                    sol_v += point[:net.t]
+                    sol_w += point[net.t:]
                 
-            s.pop()
-
-        count = 0
-        for p in net.places:
-            count += 1
-            if log: print("second step: "+str(round(count/net.p*100, 2))+"%")
-
-            s.push()
-            s.add(w[p.id]>0)
-
-            if s.check() == sat:
-                nb_sol += 1
-                model = s.model()
-                model_fraction_V = modelToFloat(model, v, "v")
-                model_fraction_W = modelToFloat(model, w, "w")
-                sol_v += model_fraction_V
-                sol_w += model_fraction_W
+                s.pop()
+
+            count = 0
+            for p in range(net.p):
+                count += 1
+                if log: print("second step: "+str(round(count/net.p*100, 2))+"%")
+
+                if sol_w[p]>0: continue # already positive in a previous model
+
+                s.push()
+                s.addPositive(net.t+p)
+
+                if s.check():
+                    nb_sol += 1
+                    point = s.point()
+                    sol_v += point[:net.t]
+                    sol_w += point[net.t:]
                 
-            s.pop()
+                s.pop()
 
-        # print("Number of solutions:", nb_sol)
-        if nb_sol==0:
-            return False,previous_m
-        else:
-            sol_v /= nb_sol
-            sol_w /= nb_sol
+            # print("Number of solutions:", nb_sol)
+            if nb_sol==0:
+                return False,previous_m
+            else:
+                sol_v /= nb_sol
+                sol_w /= nb_sol
 
         # print("Solution founed")
 
         Tp = net.supportTransitionVector(sol_v)
-        oTpo = set()
-        for t in Tp:
-            oTpo = oTpo.union(t.preset)
-            oTpo = oTpo.union(t.postset)
+        oTpo = net.tSetPreset(Tp).union(net.tSetPostset(Tp))
             
         m0_oTpo = net.restriction(net.marking, oTpo)
         maxFS_m0 = isFireable(net, Tp, m0_oTpo)[1]
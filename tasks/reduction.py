@@ -0,0 +1,250 @@
+"""
+Structural reductions of a net, for a source and a target marking, which
+preserve continuous reachability and coverability. The rules are:
+    - "selfloop": removes the transitions with identical pre and post
+      (firing them does not change the marking)
+    - "dead": removes the transitions that are not in the maximal firing
+      set from the source (and, for reachability, not in the one of the
+      inverse net from the target), only when no separator is needed
+    - "duplicate": keeps one transition of each class of transitions
+      with identical pre and post
+    - "isolated": removes the places without arc which have the same
+      number of tokens in the source and the target (or, for coverability,
+      at least as many tokens in the source)
+The results on the reduced net are mapped back by the Reduction object.
+"""
+
+import numpy as np
+from objects.Net import Net
+from objects.Bitset import Bitset
+from objects.Formula import Formula, Clause, Atom, AtomPool, Syndrome, SparseVector
+from tasks.reachability import isFireable, isReachable, isCoverable
+from tasks.separators import generateLocallyClosedBiSeparator
+
+RULES = ("selfloop", "dead", "duplicate", "isolated")
+
+
+class Reduction:
+    """
+    Class for the reduction of a net, with the maps back to the original net.
+
+    Attributs:
+        original: the original net
+        net: the reduced net
+        places: original ids of the places kept, indexed by reduced id
+        transitions: original ids of the transitions kept, indexed by
+            reduced id
+        representative: for each original transition, the original id of
+            the kept transition with the same pre and post (itself if kept),
+            or -1 if it was removed otherwise
+        removed: dictionary rule->(number of places, number of transitions)
+            removed by the rule
+        verdict: False if the reduction found out that the target is not
+            reachable (or coverable), else None
+    """
+
+    def __init__(self, original, places, transitions, representative, removed, verdict):
+        self.original = original
+        self.places = places
+        self.transitions = transitions
+        self.representative = representative
+        self.removed = removed
+        self.verdict = verdict
+        pre = original.pre[places][:,transitions]
+        post = original.post[places][:,transitions]
+        self.net = Net(original.name, [original.placeNames[p] for p in places],
+                       [original.transitionNames[t] for t in transitions],
+                       np.asarray(original.marking)[places], pre, post)
+
+    def reduceMarking(self, m):
+        """
+        Restricts a marking of the original net to the places kept.
+        """
+        return np.asarray(m)[self.places]
+
+    def liftVector(self, a):
+        """
+        Pads a place vector of the reduced net with zeros for the places
+        removed.
+        """
+        if isinstance(a, SparseVector):
+            return SparseVector(self.places[a.indices], a.values, self.original.p)
+        vect = np.zeros(self.original.p)
+        vect[self.places] = a
+        return vect
+
+    def liftSeparator(self, phi: Formula):
+        """
+        Maps a locally closed bi-separator of the reduced net back to the
+        original net: the atoms are padded with zeros, a removed duplicate
+        transition gets the syndromes of its representative, and a removed
+        self-loop transition gets the identity syndromes (each atom implies
+        itself, as the transition does not change the marking).
+
+        Args:
+            phi: the separator of the reduced net
+
+        Return:
+            phi: the separator of the original net
+        """
+        # Reduced id of the representative of each transition kept
+        reducedId = np.full(self.original.t, -1)
+        reducedId[self.transitions] = np.arange(len(self.transitions))
+        kept = np.flatnonzero(self.representative>=0)
+        reduced = reducedId[self.representative[kept]]
+        pool = AtomPool()
+        liftedIds = dict() # key: atom id in phi, value: atom id in the lifted pool
+        clauses = []
+        for clause in phi.clauses:
+            for i in clause.ids.tolist():
+                if i not in liftedIds:
+                    atom = phi.pool[i]
+                    liftedIds[i] = pool.add(Atom(self.liftVector(atom.a), self.liftVector(atom.ap), atom.strict))
+            lifted = Clause.fromIds([liftedIds[i] for i in clause.ids.tolist()], clause.id, pool)
+            identity = Syndrome.uniform(self.original.t, clause.id, Syndrome.progression(0, clause.size))
+            lifted.forwardSyndrome = identity.copy()
+            lifted.forwardSyndrome.target[kept] = clause.forwardSyndrome.target[reduced]
+            lifted.forwardSyndrome.maps[kept] = clause.forwardSyndrome.maps[reduced]
+            lifted.backwardSyndrome = identity
+            lifted.backwardSyndrome.target[kept] = clause.backwardSyndrome.target[reduced]
+            lifted.backwardSyndrome.maps[kept] = clause.backwardSyndrome.maps[reduced]
+            clauses.append(lifted)
+        return Formula(self.original, clauses, pool)
+
+    def printStats(self):
+        print("--Net reduction-----------")
+        print("Places:", self.original.p, "->", self.net.p)
+        print("Transitions:", self.original.t, "->", self.net.t)
+        for rule in RULES:
+            if rule in self.removed:
+                print("Rule "+rule+":", self.removed[rule][0], "places,", self.removed[rule][1], "transitions")
+        print("--------------------------")
+
+
+def columnKey(A, t):
+    """
+    Hashable key of the column t of a CSC matrix (indices and weights).
+    """
+    start, stop = A.indptr[t], A.indptr[t+1]
+    return (A.indices[start:stop].tobytes(), A.data[start:stop].tobytes())
+
+
+def reduceNet(net: Net, m, msrc=None, coverability=False, separator=False):
+    """
+    Applies the reductions to a net for (msrc,m).
+
+    Args:
+        net: the Petri net
+        m: the target marking
+        msrc: the source marking (net.marking by default)
+        coverability: True if the question is the coverability of m
+        separator: True if a separator is computed on the reduced net (the
+            rule "dead" is not applied)
+
+    Return:
+        reduction: the Reduction object
+    """
+    msrc = np.asarray(net.marking if msrc is None else msrc)
+    m = np.asarray(m)
+    kept = Bitset.full(net.t)
+    representative = np.arange(net.t)
+    removed = dict()
+
+    # Transitions with identical pre and post
+    loops = np.array([columnKey(net.pre, t)==columnKey(net.post, t) for t in range(net.t)], dtype=bool)
+    kept = kept - Bitset(loops)
+    representative[loops] = -1
+    removed["selfloop"] = (0, int(np.count_nonzero(loops)))
+
+    # Transitions which can not be fired in a run from msrc (to m)
+    if not separator:
+        fireable = isFireable(net, kept, msrc)[1]
+        if not coverability:
+            fireable = fireable.intersection(isFireable(net, fireable, m, True)[1])
+        dead = kept - fireable
+        kept = fireable
+        representative[dead.bits] = -1
+        removed["dead"] = (0, len(dead))
+
+    # Transitions with the same pre and post as a previous one
+    classes = dict()
+    nb_duplicates = 0
+    for t in kept:
+        key = (columnKey(net.pre, t), columnKey(net.post, t))
+        if key in classes:
+            representative[t] = classes[key]
+            nb_duplicates += 1
+        else:
+            classes[key] = t
+    kept = Bitset(representative==np.arange(net.t))
+    removed["duplicate"] = (0, nb_duplicates)
+
+    # Places without arc to the transitions kept
+    isolated = ~(net.tSetPreset(kept).bits | net.tSetPostset(kept).bits)
+    verdict = None
+    if coverability: unchanged = m<=msrc
+    else: unchanged = m==msrc
+    if np.any(isolated & ~unchanged): verdict = False
+    isolated &= unchanged
+    removed["isolated"] = (int(np.count_nonzero(isolated)), 0)
+
+    return Reduction(net, np.flatnonzero(~isolated), kept.ids(), representative, removed, verdict)
+
+
+def isReachableReduced(net: Net, m, log=False, **kwargs):
+    """
+    Decision algorithm for reachability, on the reduced net.
+
+    Args:
+        net: the net
+        m: the target marking
+        log: True will print the avancement and the reduction
+        kwargs: other arguments of isReachable
+
+    Return:
+        bool: True iff m is reachable from net.marking
+    """
+    reduction = reduceNet(net, m)
+    if log: reduction.printStats()
+    if reduction.verdict is not None: return reduction.verdict
+    return isReachable(reduction.net, reduction.reduceMarking(m), log=log, **kwargs)
+
+
+def isCoverableReduced(net: Net, m, log=False, **kwargs):
+    """
+    Decision algorithm for coverability, on the reduced net.
+
+    Args:
+        net: the net
+        m: the target marking
+        log: True will print the avancement and the reduction
+        kwargs: other arguments of isCoverable
+
+    Return:
+        bool: True iff m is coverable from net.marking
+    """
+    reduction = reduceNet(net, m, coverability=True)
+    if log: reduction.printStats()
+    if reduction.verdict is not None: return reduction.verdict
+    return isCoverable(reduction.net, reduction.reduceMarking(m), log=log, **kwargs)
+
+
+def generateReducedLocallyClosedBiSeparator(net: Net, msrc, mtgt, log=False):
+    """
+    Constructs a locally closed bi-separator for (msrc,mtgt) on the reduced
+    net, and maps it back to the net.
+
+    Args:
+        net: the Petri net
+        msrc: the source marking
+        mtgt: the target marking
+        log: True will print the reduction
+
+    Return:
+        bisep: locally closed bi-separator for (msrc,mtgt)
+    """
+    reduction = reduceNet(net, mtgt, msrc=msrc, separator=True)
+    if log: reduction.printStats()
+    reduced = reduction.net
+    psi = generateLocallyClosedBiSeparator(reduced, reduced.transitions, reduction.reduceMarking(msrc), reduction.reduceMarking(mtgt))
+    return reduction.liftSeparator(psi)
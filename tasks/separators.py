@@ -1,14 +1,18 @@
 from math import *
+from collections import OrderedDict
 import numpy as np
-from scipy.sparse import csr_matrix
+from scipy.sparse import csr_matrix, identity, hstack
 import time
 from z3 import *
 from tasks.utilities import *
+from tasks.solvers import newSystem
 from objects.Net import Net, Transition, Place
-from objects.Formula import Formula, Clause, Atom
+from objects.Bitset import Bitset
+from objects.Formula import Formula, Clause, Atom, AtomPool, Syndrome, SparseVector, denseVector, concatenateVectors, alignedSupport
 
-EPS = 0.0000000001
 INF = 1e8
+IMPLICATION_CACHE_SIZE = 1<<16
+IMPLICATION_BATCH_SIZE = 1<<22 # maximal number of stacked atom coefficients in a batch
 
 def largestSiphon(net: Net, Up, msrc):
     """
@@ -16,41 +20,13 @@ def largestSiphon(net: Net, Up, msrc):
     
     Args:
         net: the Petri net
-        Up: a subset of transitions
+        Up: a subset of transitions (set or bitset)
         msrc: the source marking
 
     Return:
-        Q: the largest siphon of N_Up such that msrc(Q)=0
         vectQ: the vector corresponding to Q
     """
-    # Compute Q° as a transition vector
-    vectQ = np.int64(msrc==0)
-    vectQo = np.zeros(net.t)
-    for i in range(len(vectQ)):
-        if vectQ[i]==1:
-            for t in net.places[i].postset:
-                if t in Up:
-                    vectQo[t.id] += 1
-
-    # While there is p in Q s.t. some t in °p is not in Q°
-    flag = True
-    while flag:
-        flag = False
-        for i in range(net.p):
-            breakFirstLoop = False
-            if vectQ[i]==1:
-                for t in net.places[i].preset:
-                    if t in Up and vectQo[t.id]==0:
-                        # Then we remove p and update Q°
-                        vectQ[i] = 0
-                        for u in net.places[i].postset:
-                            vectQo[u.id] = max(0,vectQo[u.id]-1)
-                        flag = True
-                        breakFirstLoop = True
-                        break
-            if breakFirstLoop: break
-
-    return vectQ
+    return largestSiphonAndTrap(net, Up, msrc, None)[0]
 
 
 def largestTrap(net: Net, Up, mtgt):
@@ -59,57 +35,173 @@ def largestTrap(net: Net, Up, mtgt):
     
     Args:
         net: the Petri net
-        Up: a subset of transitions
+        Up: a subset of transitions (set or bitset)
         mtgt: the target marking
 
     Return:
-        R: the largest trap of N_Up such that mtgt(Q)=0
         vectR: the vector corresponding to R
     """
-    # Compute °R as a transition vector
-    vectR = np.int64(mtgt==0)
-    vectoR = np.zeros(net.t)
-    for i in range(len(vectR)):
-        if vectR[i]==1:
-            for t in net.places[i].preset:
-                if t in Up:
-                    vectoR[t.id] += 1
-
-    # While there is p in R s.t. some t in p° is not in °R
-    flag = True
-    while flag:
-        flag = False
-        for i in range(net.p):
-            breakFirstLoop = False
-            if vectR[i]==1:
-                for t in net.places[i].postset:
-                    if t in Up and vectoR[t.id]==0:
-                        # Then we remove p and update °R
-                        vectR[i] = 0
-                        for u in net.places[i].preset:
-                            vectoR[u.id] = max(0,vectoR[u.id]-1)
-                        flag = True
-                        breakFirstLoop = True
-                        break
-            if breakFirstLoop: break
-    
-    return vectR
+    return largestSiphonAndTrap(net, Up, None, mtgt)[1]
+
+
+def largestSiphonAndTrap(net: Net, Up, msrc, mtgt):
+    """
+    Find the largest siphon Q of N_Up such that msrc(Q)=0 and the largest 
+    trap R of N_Up such that mtgt(R)=0 (a trap is a siphon of the reverse 
+    net). Each transition counts its input places in the set, and each 
+    place is removed once, so that every arc is visited a bounded number 
+    of times.
+
+    Args:
+        net: the Petri net
+        Up: a subset of transitions (set or bitset)
+        msrc: the source marking (None to skip the siphon)
+        mtgt: the target marking (None to skip the trap)
+
+    Return:
+        vectQ: the vector corresponding to Q (or None)
+        vectR: the vector corresponding to R (or None)
+    """
+    inUp = net.transitionBits(Up).bits
+    vectQ = None if msrc is None else largestClosedSet(net.pre, net.post, net.preCsr, inUp, np.asarray(msrc)==0)
+    vectR = None if mtgt is None else largestClosedSet(net.post, net.pre, net.postCsr, inUp, np.asarray(mtgt)==0)
+    return vectQ,vectR
+
+
+def largestClosedSet(inputs, outputs, consumers, inUp, S):
+    """
+    Largest subset Q of S such that every transition of Up with an output 
+    place in Q has an input place in Q (a siphon for the arcs of the net, a 
+    trap for the reversed arcs).
+
+    Args:
+        inputs: input arc weights in CSC format (column t gives °t)
+        outputs: output arc weights in CSC format (column t gives t°)
+        consumers: input arc weights in CSR format (row p gives p°)
+        inUp: bool array of the transitions of Up
+        S: bool array of the initial set of places
+
+    Return:
+        vectQ: the vector corresponding to Q
+    """
+    t = inputs.shape[1]
+    inQ = np.array(S, dtype=bool)
+    # count[u] = number of input places of u in Q, for u in Up
+    count = np.bincount(np.repeat(np.arange(t), np.diff(inputs.indptr)), 
+                        weights=inQ[inputs.indices], minlength=t).astype(np.int64)
+    count[~inUp] = 0
+    emptied = inUp & (count==0)
+    stack = np.flatnonzero(inQ & (outputs.dot(emptied.astype(float))>0)).tolist()
+
+    out_indptr, out_indices = outputs.indptr.tolist(), outputs.indices.tolist()
+    cons_indptr, cons_indices = consumers.indptr.tolist(), consumers.indices.tolist()
+    inUp, inQ, count = inUp.tolist(), inQ.tolist(), count.tolist()
+    while len(stack)>0:
+        p = stack.pop()
+        if not inQ[p]: continue
+        inQ[p] = False
+        for u in cons_indices[cons_indptr[p]:cons_indptr[p+1]]:
+            if inUp[u]:
+                count[u] -= 1
+                # u has no input place left in Q: its output places leave Q
+                if count[u]==0:
+                    for q in out_indices[out_indptr[u]:out_indptr[u+1]]:
+                        if inQ[q]: stack.append(q)
+    return np.int64(inQ)
+
+
+def separatorSystems(net: Net, msrc, mtgt):
+    """
+    Builds the X and Y systems of generateLocallyClosedBiSeparator once for 
+    all the recursive calls, the constraints depending on U being 
+    selectable rows:
+        X: x>=0, F*x==b and x[t]==0 for t not in U
+        Y: FT[t]*y>=0 for t in U and b*y<=0
+
+    Args:
+        net: the Petri net
+        msrc: the source marking
+        mtgt: the target marking
+
+    Return:
+        X: the X system
+        Y: the Y system
+    """
+    b = mtgt - msrc
+    X = newSystem(net.t)
+    X.addEq(net.incidenceCsr, b)
+    X.addSelectable(identity(net.t, format="csr"), np.zeros(net.t), "==")
+
+    Y = newSystem(net.p, nonnegative=False)
+    Y.addLe(b[None,:], [0])
+    Y.addSelectable(-net.incidenceTranspose, np.zeros(net.t), "<=")
+    return X,Y
 
 
-def generateLocallyClosedBiSeparator(net: Net, U, msrc, mtgt):
+def generateLocallyClosedBiSeparator(net: Net, U, msrc, mtgt, systems=None):
     """
     Constructs a locally closed bi-separator for (msrc,mtgt) given that mtgt 
     is not reachable from msrc using transitions in U (Algorithm 1 of [1]).
+    Each level of the algorithm makes at most one recursive call, so the 
+    levels are computed iteratively: the data of each level is pushed on a 
+    stack until a base case is reached, then the clauses are assembled 
+    bottom-up by popping the stack. All the clauses share one atom pool.
 
     Args:
         net: the Petri net
         U: a subset of transitions
         msrc: the source marking
         mtgt: the target marking
+        systems: the X and Y systems given by separatorSystems (built if 
+            None)
 
     Return:
         bisep: locally closed bi-separator for (msrc,mtgt)
     """
+    if systems is None: systems = separatorSystems(net, msrc, mtgt)
+    pool = AtomPool()
+    stack = []
+    psi = None
+    while psi is None:
+        psi,level,U = separatorLevel(net, U, msrc, mtgt, systems, pool)
+        if level is not None: stack.append(level)
+    while len(stack)>0:
+        psi = assembleSeparatorLevel(net, stack.pop(), psi)
+    return psi
+
+
+def singleClauseSeparator(net: Net, atom: Atom, pool: AtomPool):
+    """
+    Separator with a single clause made of a single atom, every transition 
+    having the syndrome of the atom itself.
+    """
+    clause = Clause([atom], 0, pool)
+    clause.forwardSyndrome = Syndrome.uniform(net.t, clause.id, Syndrome.progression(0, 1))
+    clause.backwardSyndrome = clause.forwardSyndrome
+    return Formula(net, [clause], pool)
+
+
+def separatorLevel(net: Net, U, msrc, mtgt, systems, pool: AtomPool):
+    """
+    Computes one level of Algorithm 1 of [1] for U: either a base case, 
+    which gives a separator directly, or the data of the level and the set 
+    of transitions of the next level.
+
+    Args:
+        net: the Petri net
+        U: a subset of transitions
+        msrc: the source marking
+        mtgt: the target marking
+        systems: the X and Y systems given by separatorSystems
+        pool: the atom pool of the clauses
+
+    Return:
+        psi: the separator for U in a base case, else None
+        level: the data of the level used by assembleSeparatorLevel (None 
+            in a base case)
+        U: the subset of transitions of the next level (None in a base 
+            case)
+    """
     # Case U empty
     if len(U)==0:
         p = 0
@@ -118,157 +210,160 @@ def generateLocallyClosedBiSeparator(net: Net, U, msrc, mtgt):
         assert p<net.p, "Error: msrc=mtgt"
         a = np.zeros(net.p)
         a[p] = copysign(1,msrc[p]-mtgt[p])
-
-        clause = Clause([Atom(a, a)], 0)
-        for t in net.transitions:
-            clause.forwardSyndrome[t.name] = (clause.id,[0])
-            clause.backwardSyndrome[t.name] = (clause.id,[0])
-        return Formula(net, [clause])
+        return singleClauseSeparator(net, Atom(a, a), pool), None, None
     
-    # X solver initialization
-    X = Solver()
+    # X and Y systems restricted to U
+    X,Y = systems
     b = mtgt - msrc
-    x = np.array([Real("x%i" % i) for i in range(net.t)])
-    cstrt_positive = [x[i]>=0 for i in range(net.t)]
-    F = net.incidenceMatrix(net.transitions)
-    F_dot_x = sparseDot(F, x)
-    cstrt_matrix = [F_dot_x[i]==b[i] for i in range(net.p)]
+    FT = net.incidenceTranspose
     vectU = transitionSetToVector(net, U)
-    cstrt_inclusion = [simplify(Or(x[i]==0, bool(vectU[i]>0))) for i in range(net.t)]
-    atoms = cstrt_positive + cstrt_matrix + cstrt_inclusion
-    X.add(simplify(And(atoms)))
-
-    # Y solver initialization
-    Y = Solver()
-    y = np.array([Real("y%i" % i) for i in range(net.p)])
-    FT = csr_matrix(F.transpose())
-    FT_dot_y = sparseDot(FT, y)
-    cstrt_matrix = [FT_dot_y[t.id]>=0 for t in U]
-    bT_dot_y = b.dot(y)
-    Y.add(simplify(And(cstrt_matrix+[bT_dot_y <= 0])))
+    X.select(np.flatnonzero(vectU==0))
+    Y.select(np.flatnonzero(vectU>0))
 
     # Case X empty
-    if X.check() == unsat:
+    if not X.check():
         Y.push()
-        Y.add(bT_dot_y < 0)
-        assert Y.check()==sat, "Error: Y_empty has no solution"
-        y_empty = modelToFloat(Y.model(), y, "y")
+        Y.addLt(b[None,:], [0])
+        assert Y.check(), "Error: Y_empty has no solution"
+        y_empty = Y.point()
         Y.pop()
-        clause = Clause([Atom(y_empty, y_empty)], 0)
-        for t in net.transitions:
-            clause.forwardSyndrome[t.name] = (clause.id,[0])
-            clause.backwardSyndrome[t.name] = (clause.id,[0])
-        return Formula(net, [clause])
+        return singleClauseSeparator(net, Atom(y_empty, y_empty), pool), None, None
+
     #Case X none empty
-    else:
-        Up = set()
-        for u in U:
-            X.push()
-            X.add(x[u.id]>0)
-            if X.check() == sat:
-                Up.add(u)
-            X.pop()
-        
-        # Compute case 1 clauses
-        clauses_case1 = []
-        clause_id = 0 # Incrementing clause id
-        clauses_Cu = dict() # key: transition name, value: clause id
-        atoms_phi_inv = dict() # key: transition name, value: atom index
-        phi_inv = []
-        U_diff_Up = U.difference(Up)
-        for t in U_diff_Up:
-            Y.push()
-            Y.add(bT_dot_y < FT_dot_y[t.id])
-            assert Y.check()==sat, "Error: Y has no solution"
-            yt = modelToFloat(Y.model(), y, "y")
-            Y.pop()
-            atom = Atom(yt, yt)
-            phi_inv.append(atom)
-            atoms_phi_inv[t.name] = len(phi_inv)-1
-            clause = Clause([Atom(yt, yt, strict=True)], clause_id)
-            clause_id += 1
-            for u in net.transitions:
-                clause.forwardSyndrome[u.name] = (clause.id,[0])
-                clause.backwardSyndrome[u.name] = (clause.id,[0])
-            clauses_Cu[t.name] = clause.id
-            clauses_case1.append(clause)
-            if np.dot(yt,msrc)>np.dot(yt,mtgt):
-                clause.id = 0
-                for u in net.transitions:
-                    clause.forwardSyndrome[u.name] = (clause.id,[0])
-                    clause.backwardSyndrome[u.name] = (clause.id,[0])
-                return Formula(net, [clause])
-
-        # Compute largest siphon and trap
-        vectQ = largestSiphon(net, Up, msrc)
-        Q = placeVectorToSet(net, vectQ)
-        Qo = placeSetPostset(net, Q)
-        vectR = largestTrap(net, Up, mtgt)
-        R = placeVectorToSet(net, vectR)
-        oR = placeSetPreset(net, R)
-        
-        # Compute recursive call
-        QoUoR = Qo.union(oR)
-        Up_diff_QoUoR = Up.difference(QoUoR)
-        psi = generateLocallyClosedBiSeparator(net, Up_diff_QoUoR, msrc, mtgt)
-
-        # Compute case 2 clause
-        C2 = Clause(phi_inv+[Atom(-vectQ, vectR, strict=True)], clause_id)
+    Up = set()
+    for u in U:
+        if u in Up: continue # already positive in a previous model
+        X.push()
+        X.addPositive(u.id)
+        if X.check():
+            x_model = X.point()
+            Up.update(net.transitionList[i] for i in np.flatnonzero(x_model>0))
+        X.pop()
+    
+    # Compute case 1 clauses
+    clauses_case1 = []
+    clauses_Cu = dict() # key: transition id, value: clause id
+    atoms_phi_inv = dict() # key: transition id, value: atom index
+    phi_inv = [] # atom ids of the invariants
+    U_diff_Up = U.difference(Up)
+    for t in U_diff_Up:
+        Y.push()
+        Y.addLt(b[None,:]-FT[t.id], [0])
+        assert Y.check(), "Error: Y has no solution"
+        yt = Y.point()
+        Y.pop()
+        if np.dot(yt,msrc)>np.dot(yt,mtgt):
+            return singleClauseSeparator(net, Atom(yt, yt, strict=True), pool), None, None
+        phi_inv.append(pool.add(Atom(yt, yt)))
+        atoms_phi_inv[t.id] = len(phi_inv)-1
+        clause = Clause([Atom(yt, yt, strict=True)], len(clauses_case1), pool)
+        clause.forwardSyndrome = Syndrome.uniform(net.t, clause.id, Syndrome.progression(0, 1))
+        clause.backwardSyndrome = clause.forwardSyndrome
+        clauses_Cu[t.id] = clause.id
+        clauses_case1.append(clause)
+
+    # Compute largest siphon and trap
+    vectQ,vectR = largestSiphonAndTrap(net, Up, msrc, mtgt)
+    inQo = net.pSetPostset(Bitset(vectQ>0)).bits
+    inoR = net.pSetPreset(Bitset(vectR>0)).bits
+    
+    level = (net.transitionBits(Up).bits, U_diff_Up, inQo, inoR, vectQ, vectR, phi_inv, atoms_phi_inv, clauses_case1, clauses_Cu)
+    return None, level, set(u for u in Up if not inQo[u.id] and not inoR[u.id])
+
+
+def assembleSeparatorLevel(net: Net, level, psi: Formula):
+    """
+    Assembles the separator of a level of Algorithm 1 of [1] from the 
+    separator psi of the next level, in the atom pool of psi.
+
+    Args:
+        net: the Petri net
+        level: the data of the level given by separatorLevel
+        psi: the separator of the next level
+
+    Return:
+        bisep: the separator of the level
+    """
+    inUp, U_diff_Up, inQo, inoR, vectQ, vectR, phi_inv, atoms_phi_inv, clauses_case1, clauses_Cu = level
+    pool = psi.pool
+    clause_id = len(clauses_case1) # Incrementing clause id
+
+    # Compute case 2 clause (phi_inv holds atom ids)
+    C2 = Clause.fromIds(phi_inv+[pool.add(Atom(-vectQ, vectR, strict=True))], clause_id, pool)
+    clause_id += 1
+    clauses_case2 = [C2]
+
+    # Compute case 3 clauses
+    clauses_case3 = []
+    prefix = np.array(phi_inv+[pool.add(Atom(vectR, -vectQ))], dtype=np.int64)
+    for clause in psi.clauses:
+        clause3 = Clause.fromIds(np.concatenate((prefix, clause.ids)), clause_id, pool)
         clause_id += 1
-        clauses_case2 = [C2]
-
-        # Compute case 3 clauses
-        clauses_case3 = []
-        atomSiphonTrap = Atom(vectR, -vectQ)
-        for clause in psi.clauses:
-            clause3 = Clause(phi_inv+[atomSiphonTrap]+clause.atoms, clause_id)
-            clause_id += 1
-            clause3.forwardSyndromeIH = clause.forwardSyndrome
-            clause3.backwardSyndromeIH = clause.backwardSyndrome
-            clauses_case3.append(clause3)
-
-        # Syndrome assignement for C2
-        for u in U_diff_Up:
-            C2.forwardSyndrome[u.name] = (clauses_Cu[u.name],[atoms_phi_inv[u.name]])
-            C2.backwardSyndrome[u.name] = (clauses_Cu[u.name],[atoms_phi_inv[u.name]])
-        for u in Up:
-            C2.forwardSyndrome[u.name] = (C2.id,[i for i in range(C2.size)])
-            C2.backwardSyndrome[u.name] = (C2.id,[i for i in range(C2.size)])
-
-        # Forward syndrome assignement for Ci
-        for Ci in clauses_case3:
-            for u in U_diff_Up:
-                Ci.forwardSyndrome[u.name] = (clauses_Cu[u.name],[atoms_phi_inv[u.name]])
-            for u in Up:
-                if u in oR:
-                    Ci.forwardSyndrome[u.name] = (C2.id,[i for i in range(C2.size)])
-                elif u in Qo:
-                    Ci.forwardSyndrome[u.name] = (C2.id,[len(phi_inv) for i in range(C2.size)])
-                else:
-                    j = Ci.forwardSyndromeIH[u.name][0]+len(clauses_case1)+1
-                    syndrome_phi_inv_theta = [i for i in range(len(phi_inv)+1)]
-                    syndrome_IH = [x+len(phi_inv)+1 for x in Ci.forwardSyndromeIH[u.name][1]]
-                    Ci.forwardSyndrome[u.name] = (j, syndrome_phi_inv_theta+syndrome_IH)
-
-        # Backward syndrome assignement for Ci
-        for Ci in clauses_case3:
-            for u in U_diff_Up:
-                Ci.backwardSyndrome[u.name] = (clauses_Cu[u.name],[atoms_phi_inv[u.name]])
-            for u in Up:
-                if u in Qo:
-                    Ci.backwardSyndrome[u.name] = (C2.id,[i for i in range(C2.size)])
-                elif u in oR:
-                    Ci.backwardSyndrome[u.name] = (C2.id,[len(phi_inv) for i in range(C2.size)])
-                else:
-                    j = Ci.backwardSyndromeIH[u.name][0]+len(clauses_case1)+1
-                    syndrome_phi_inv_theta = [i for i in range(len(phi_inv)+1)]
-                    syndrome_IH = [x+len(phi_inv)+1 for x in Ci.backwardSyndromeIH[u.name][1]]
-                    Ci.backwardSyndrome[u.name] = (j, syndrome_phi_inv_theta+syndrome_IH)
-
-        # Formula concatenation
-        clauses = clauses_case1 + clauses_case2 + clauses_case3
-        bisep = Formula(net, clauses)
-        return bisep
+        clause3.forwardSyndromeIH = clause.forwardSyndrome
+        clause3.backwardSyndromeIH = clause.backwardSyndrome
+        clauses_case3.append(clause3)
+
+    # Syndrome assignement for C2 (same forward and backward syndrome)
+    k = len(phi_inv)
+    ids_inv = [u.id for u in U_diff_Up]
+    clauses_inv = [clauses_Cu[u] for u in ids_inv]
+    maps_inv = [Syndrome.progression(atoms_phi_inv[u], 1, 0) for u in ids_inv]
+    identity_C2 = Syndrome.progression(0, C2.size)
+    constant_C2 = Syndrome.progression(k, C2.size, 0)
+    C2.forwardSyndrome = Syndrome(net.t)
+    C2.forwardSyndrome.assign(ids_inv, clauses_inv, maps_inv)
+    C2.forwardSyndrome.assign(np.flatnonzero(inUp), C2.id, identity_C2)
+    C2.backwardSyndrome = C2.forwardSyndrome
+
+    # Syndromes of Ci for the transitions of U\Up, Qo and oR
+    forward = Syndrome(net.t)
+    forward.assign(ids_inv, clauses_inv, maps_inv)
+    forward.assign(np.flatnonzero(inUp & inoR), C2.id, identity_C2)
+    forward.assign(np.flatnonzero(inUp & inQo & ~inoR), C2.id, constant_C2)
+    backward = Syndrome(net.t)
+    backward.assign(ids_inv, clauses_inv, maps_inv)
+    backward.assign(np.flatnonzero(inUp & inQo), C2.id, identity_C2)
+    backward.assign(np.flatnonzero(inUp & inoR & ~inQo), C2.id, constant_C2)
+
+    # Syndromes of Ci for the other transitions of Up, from the induction 
+    # hypothesis: the atoms of phi_inv and theta are mapped to themselves 
+    # and the ones of the clause of psi are shifted
+    ids_IH = np.flatnonzero(inUp & ~inQo & ~inoR)
+    shifted = dict() # key: id of a map of psi, value: (map, shifted map)
+    for Ci in clauses_case3:
+        Ci.forwardSyndrome = forward.copy()
+        IH = Ci.forwardSyndromeIH
+        Ci.forwardSyndrome.assign(ids_IH, IH.target[ids_IH]+len(clauses_case1)+1, [shiftAtomMap(atoms, k+1, shifted) for atoms in IH.maps[ids_IH]])
+        Ci.backwardSyndrome = backward.copy()
+        IH = Ci.backwardSyndromeIH
+        Ci.backwardSyndrome.assign(ids_IH, IH.target[ids_IH]+len(clauses_case1)+1, [shiftAtomMap(atoms, k+1, shifted) for atoms in IH.maps[ids_IH]])
+
+    # Formula concatenation
+    clauses = clauses_case1 + clauses_case2 + clauses_case3
+    bisep = Formula(net, clauses, pool)
+    return bisep
+
+
+def shiftAtomMap(atoms, k, shifted):
+    """
+    Atom map of a clause of psi lifted to the case 3 clause with k more 
+    atoms in front: [0, ..., k-1] followed by the map shifted by k. The 
+    lifted maps are shared through the dictionary shifted.
+
+    Args:
+        atoms: the atom map of the clause of psi
+        k: the number of atoms added in front (phi_inv and the siphon/trap 
+            atom)
+        shifted: dictionary id of map->(map, lifted map)
+
+    Return:
+        atoms: the lifted atom map
+    """
+    if id(atoms) not in shifted:
+        lifted = np.concatenate((Syndrome.progression(0, k), atoms+k))
+        lifted.flags.writeable = False
+        shifted[id(atoms)] = (atoms, lifted)
+    return shifted[id(atoms)][1]
 
 
 def atomicImplicationZ3(net: Net, psi: Atom, psip: Atom, t: Transition, inv=False):
@@ -285,6 +380,9 @@ def atomicImplicationZ3(net: Net, psi: Atom, psip: Atom, t: Transition, inv=Fals
     Return:
         bool: True iff psi t-implies psip
     """
+    psi = Atom(denseVector(psi.a), denseVector(psi.ap), psi.strict)
+    psip = Atom(denseVector(psip.a), denseVector(psip.ap), psip.strict)
+
     # Return True if X empty
     if psi.strict:
         check = not all(psi.a>=0) and not all(psi.ap<=0)
@@ -331,9 +429,49 @@ def atomicImplicationZ3(net: Net, psi: Atom, psip: Atom, t: Transition, inv=Fals
     return check==sat
 
 
+def columnDot(vect, A, t):
+    """
+    Dot product of a vector of an atom with the column t of a CSC matrix, 
+    on the nonzero entries of the column.
+    """
+    start, stop = A.indptr[t], A.indptr[t+1]
+    if not isinstance(vect, SparseVector): return np.dot(vect[A.indices[start:stop]], A.data[start:stop])
+    product = 0.0
+    for p,w in zip(A.indices[start:stop].tolist(), A.data[start:stop].tolist()):
+        product += vect.get(p)*w
+    return product
+
+
+def implicationBounds(psi: Atom, psip: Atom):
+    """
+    Bounds on lamb>=0 given by lamb*a>=ap in the atomic implication of psi 
+    and psip, where a = (psi.a,-psi.ap) and ap = (psip.a,-psip.ap) (the 
+    transpose net only permutes these entries). Only the union of the 
+    supports of the atoms is visited.
+
+    Args:
+        psi: the first atomic proposition
+        psip: the second atomic proposition
+
+    Return:
+        feasible: False iff no lamb satisfies the bounds
+        lowerbound: the lower bound
+        upperbound: the upper bound (None if there is none)
+    """
+    a,ap = alignedSupport(concatenateVectors(psi.a, -psi.ap), concatenateVectors(psip.a, -psip.ap))
+    if np.any((ap>0) & (a<=0)): return False, 0, None
+    positive = (a>0) & (ap>0)
+    lowerbound = max(0, np.max(ap[positive]/a[positive])) if np.any(positive) else 0
+    negative = (a<0) & (ap<=0)
+    upperbound = np.min(ap[negative]/a[negative]) if np.any(negative) else None
+    if upperbound!=None and lowerbound>upperbound: return False, lowerbound, upperbound
+    return True, lowerbound, upperbound
+
+
 def atomicImplication(net: Net, psi: Atom, psip: Atom, t: Transition, inv=False):
     """
-    Check atomic t-implication (explained in section 6 of [1]).
+    Check atomic t-implication (explained in section 6 of [1]). Only the 
+    entries of °t, t° and the nonzero entries of the atoms are visited.
 
     Args:
         net: the Petri net
@@ -347,67 +485,28 @@ def atomicImplication(net: Net, psi: Atom, psip: Atom, t: Transition, inv=False)
     """
     # Return True if X empty
     if psi.strict:
-        check = not all(psi.a>=0) or not all(psi.ap<=0)
+        check = psi.a.min()<0 or psi.ap.max()>0
         if not check: return True
     else:
-        delta_t_minus = net.tVectorMinus(t)
-        ap_dot_delta_t_minus = np.dot(psi.ap, delta_t_minus)
+        ap_dot_delta_t_minus = columnDot(psi.ap, net.pre, t.id)
         check = ap_dot_delta_t_minus>=0
-        check |= ap_dot_delta_t_minus<0 and (not all(psi.a>=0) or not all(-psi.ap>=0))
+        check |= ap_dot_delta_t_minus<0 and (psi.a.min()<0 or psi.ap.max()>0)
         if not check: return True
 
     # If X not empty
-    a,ap,minus_bp,l = None,None,None,None
+    # (lamb*a-ap)*l = lamb*alpha-beta, where l is zero out of °t (or t° in 
+    # the transpose net)
     if not inv:
-        a = np.concatenate((psi.a, -psi.ap))
-        ap = np.concatenate((psip.a, -psip.ap))
-        minus_bp = np.dot(ap, np.concatenate((np.zeros(net.p), net.tVector(t))))
-        l = np.concatenate((np.zeros(net.p), net.tVectorMinus(t)))
+        minus_bp = -columnDot(psip.ap, net.incidence, t.id)
+        alpha = -columnDot(psi.ap, net.pre, t.id)
+        beta = -columnDot(psip.ap, net.pre, t.id)
     else:
-        a = np.concatenate((-psi.ap, psi.a))
-        ap = np.concatenate((-psip.ap, psip.a))
-        minus_bp = np.dot(ap, np.concatenate((np.zeros(net.p), -net.tVector(t))))
-        l = np.concatenate((np.zeros(net.p), net.tVectorPlus(t)))
-    
-    
-    
-    lowerbound = 0
-    upperbound = None
-    for i in range(2*net.p):
-        if a[i]==0 and ap[i]==0:
-            pass
-        elif a[i]==0 and ap[i]>0:
-            return False
-        elif a[i]==0 and ap[i]<0:
-            pass
-        elif a[i]>0 and ap[i]==0:
-            pass
-        elif a[i]>0 and ap[i]>0:
-            lowerbound = max(lowerbound, ap[i]/a[i])
-        elif a[i]>0 and ap[i]<0:
-            pass
-        elif a[i]<0 and ap[i]==0:
-            if upperbound != None:
-                upperbound = min(upperbound, 0)
-            else:
-                upperbound = 0
-        elif a[i]<0 and ap[i]>0:
-            return False
-        elif a[i]<0 and ap[i]<0:
-            if upperbound != None:
-                upperbound = min(upperbound, ap[i]/a[i])
-            else:
-                upperbound = ap[i]/a[i]
-    if upperbound!=None and lowerbound>upperbound: return False
-    
-    # (lamb*a-ap)*l = lamb*alpha-beta
-    # alpha = a[0]*l[0] + a[1]*l[1] + ...
-    # beta = ap[0]*l[0] + ap[1]*l[1] + ...
-    alpha = 0
-    beta = 0
-    for i in range(2*net.p):
-        alpha += a[i]*l[i]
-        beta += ap[i]*l[i]
+        minus_bp = -columnDot(psip.a, net.incidence, t.id)
+        alpha = columnDot(psi.a, net.post, t.id)
+        beta = columnDot(psip.a, net.post, t.id)
+
+    feasible,lowerbound,upperbound = implicationBounds(psi, psip)
+    if not feasible: return False
 
     if alpha==0:
         if not psip.strict:
@@ -415,15 +514,11 @@ def atomicImplication(net: Net, psi: Atom, psip: Atom, t: Transition, inv=False)
         elif not psi.strict:
             return minus_bp<-beta
         else:
-            return minus_bp<-beta or (minus_bp == -beta and upperbound>0)
+            return minus_bp<-beta or (minus_bp == -beta and (upperbound is None or upperbound>0))
     else:
         L = (minus_bp+beta)/alpha
         if not psip.strict:
-            # print(lowerbound)
-            # print(upperbound)
             lowerbound = max(lowerbound, L)
-            # print(lowerbound)
-            # print(upperbound)
             return upperbound==None or lowerbound<=upperbound
         elif not psi.strict:
             if L>lowerbound:
@@ -440,6 +535,240 @@ def atomicImplication(net: Net, psi: Atom, psip: Atom, t: Transition, inv=False)
             return upperbound>=L and L>=lowerbound and L>0
 
 
+def atomMatrices(pool: AtomPool, p):
+    """
+    Stacks the atoms of a pool for atomicImplicationBatch.
+
+    Args:
+        pool: the atom pool
+        p: the number of places
+
+    Return:
+        A: CSR matrix whose row i is the vector a of the atom i
+        AP: CSR matrix whose row i is the vector ap of the atom i
+        strict: bool array, strict[i] iff the atom i is strict
+        nonEmpty: bool array, nonEmpty[i] iff a has a negative entry or ap 
+            a positive entry for the atom i
+    """
+    matrices = []
+    for vectors in ([atom.a for atom in pool.atoms], [atom.ap for atom in pool.atoms]):
+        data, indices, indptr = [], [], [0]
+        for vect in vectors:
+            if not isinstance(vect, SparseVector): vect = SparseVector.fromDense(vect)
+            data.append(np.asarray(vect.values, dtype=float))
+            indices.append(vect.indices)
+            indptr.append(indptr[-1]+len(vect.indices))
+        if len(vectors)>0: data, indices = np.concatenate(data), np.concatenate(indices)
+        matrices.append(csr_matrix((data, indices, indptr), shape=(len(vectors), p)))
+    strict = np.array([atom.strict for atom in pool.atoms], dtype=bool)
+    nonEmpty = np.array([atom.a.min()<0 or atom.ap.max()>0 for atom in pool.atoms], dtype=bool)
+    return matrices[0], matrices[1], strict, nonEmpty
+
+
+def rowDots(X, rows, Y, cols):
+    """
+    Dot products of the rows X[rows[k]] and Y[cols[k]] of two CSR matrices.
+    """
+    return np.asarray(X[rows].multiply(Y[cols]).sum(axis=1)).ravel()
+
+
+def pairBounds(W, U, V):
+    """
+    Bounds on lamb of implicationBounds for pairs of atoms, with array 
+    operations on the union of the supports of their rows.
+
+    Args:
+        W: CSR matrix whose row i is (a,-ap) for the atom i
+        U: array of ids of the first atoms
+        V: array of ids of the second atoms
+
+    Return:
+        feasible: bool array, False iff no lamb satisfies the bounds of the 
+            pair (U[k], V[k])
+        lowerbound: float array of the lower bounds
+        upperbound: float array of the upper bounds (inf if there is none)
+    """
+    n, m = len(U), W.shape[1]
+    X, Y = W[U].tocoo(), W[V].tocoo()
+    keysX = X.row.astype(np.int64)*m+X.col
+    keysY = Y.row.astype(np.int64)*m+Y.col
+    keys = np.union1d(keysX, keysY)
+    a, ap = np.zeros(len(keys)), np.zeros(len(keys))
+    a[np.searchsorted(keys, keysX)] = X.data
+    ap[np.searchsorted(keys, keysY)] = Y.data
+    rows = keys//m
+
+    feasible = np.bincount(rows[(ap>0) & (a<=0)], minlength=n)==0
+    positive = (a>0) & (ap>0)
+    lowerbound = np.zeros(n)
+    np.maximum.at(lowerbound, rows[positive], ap[positive]/a[positive])
+    negative = (a<0) & (ap<=0)
+    upperbound = np.full(n, np.inf)
+    np.minimum.at(upperbound, rows[negative], ap[negative]/a[negative])
+    feasible &= lowerbound<=upperbound
+    return feasible, lowerbound, upperbound
+
+
+def atomicImplicationBatch(net: Net, matrices, I, Ip, T, inv=False):
+    """
+    Check atomic t-implication (see atomicImplication) for a batch of 
+    triples, with array operations on the stacked atoms. The bounds on 
+    lamb only depend on the pair of atoms, so they are computed once for 
+    each distinct pair (see pairBounds).
+
+    Args:
+        net: the Petri net
+        matrices: the stacked atoms of the pool given by atomMatrices
+        I: array of ids of the first atoms
+        Ip: array of ids of the second atoms
+        T: array of transition ids
+        inv: True will peform the checks in the transpose net
+
+    Return:
+        checks: bool array, checks[k] iff the atom I[k] T[k]-implies the 
+            atom Ip[k]
+    """
+    A, AP, strict, nonEmpty = matrices
+    I, Ip, T = np.asarray(I, dtype=np.int64), np.asarray(Ip, dtype=np.int64), np.asarray(T, dtype=np.int64)
+    preT, postT, incidenceT = net.pre.transpose(), net.post.transpose(), net.incidenceTranspose
+    W = hstack([A, -AP], format="csr")
+    batch = max(1, IMPLICATION_BATCH_SIZE//max(net.p,1))
+    checks = np.empty(len(I), dtype=bool)
+    for start in range(0, len(I), batch):
+        i, ip, t = I[start:start+batch], Ip[start:start+batch], T[start:start+batch]
+        s, sp = strict[i], strict[ip]
+
+        # X empty
+        ap_dot_delta_t_minus = rowDots(AP, i, preT, t)
+        emptyX = ~(nonEmpty[i] | (~s & (ap_dot_delta_t_minus>=0)))
+
+        # (lamb*a-ap)*l = lamb*alpha-beta
+        if not inv:
+            minus_bp = -rowDots(AP, ip, incidenceT, t)
+            alpha = -ap_dot_delta_t_minus
+            beta = -rowDots(AP, ip, preT, t)
+        else:
+            minus_bp = -rowDots(A, ip, incidenceT, t)
+            alpha = rowDots(A, i, postT, t)
+            beta = rowDots(A, ip, postT, t)
+
+        # Bounds on lamb given by lamb*a>=ap, for each distinct pair
+        pairs, pair = np.unique(i*A.shape[0]+ip, return_inverse=True)
+        feasible, lowerbound, upperbound = pairBounds(W, pairs//A.shape[0], pairs%A.shape[0])
+        reject, lowerbound, upperbound = ~feasible[pair], lowerbound[pair], upperbound[pair]
+
+        # Verdicts (no upperbound is an infinite one)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            L = (minus_bp+beta)/alpha
+        zero = np.where(~sp, minus_bp<=-beta, np.where(~s, minus_bp<-beta, 
+                        (minus_bp<-beta) | ((minus_bp==-beta) & (upperbound>0))))
+        above = np.where(L>lowerbound, L<upperbound, lowerbound<=upperbound)
+        nonzero = np.where(~sp, np.maximum(lowerbound, L)<=upperbound, np.where(~s, above, 
+                           above | ((upperbound>=L) & (L>=lowerbound) & (L>0))))
+        checks[start:start+batch] = emptyX | (~reject & np.where(alpha==0, zero, nonzero))
+    return checks
+
+
+class ImplicationCache:
+    """
+    Class for a bounded LRU cache of atomic implication checks between the 
+    atoms of a pool, keyed by (atom id, atom id, transition id, inv).
+
+    Attributs:
+        net: the Petri net
+        pool: the atom pool
+        size: maximal number of entries
+        entries: ordered dictionary key->bool, least recently used first
+        hits: number of checks found in the cache
+        misses: number of checks performed
+        matrices: the stacked atoms of the pool (see atomMatrices), built 
+            for the first batch
+    """
+
+    def __init__(self, net: Net, pool: AtomPool, size=IMPLICATION_CACHE_SIZE):
+        self.net = net
+        self.pool = pool
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.matrices = None
+
+    def implies(self, i, ip, t: Transition, inv=False):
+        """
+        Check atomic t-implication between the atoms of ids i and ip of the 
+        pool (see atomicImplication).
+        """
+        key = (int(i), int(ip), t.id, inv)
+        check = self.entries.get(key)
+        if check is None:
+            self.misses += 1
+            check = atomicImplication(self.net, self.pool[i], self.pool[ip], t, inv)
+            self.entries[key] = check
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return check
+
+    def impliesMany(self, I, Ip, T, inv=False):
+        """
+        Check atomic t-implication for a batch of triples of atom ids and 
+        transition ids: the repeated triples and the ones in the cache are 
+        hits, the others are checked by atomicImplicationBatch.
+
+        Args:
+            I: array of ids of the first atoms
+            Ip: array of ids of the second atoms
+            T: array of transition ids
+            inv: True will peform the checks in the transpose net
+
+        Return:
+            checks: bool array of the checks of the triples
+        """
+        if len(I)==0: return np.ones(0, dtype=bool)
+        # Triples encoded as the integers (i*|pool|+ip)*|T|+t, for a fast unique
+        nbAtoms, nbTransitions = len(self.pool), self.net.t
+        I, Ip, T = np.asarray(I, dtype=np.int64), np.asarray(Ip, dtype=np.int64), np.asarray(T, dtype=np.int64)
+        keys, index = np.unique((I*nbAtoms+Ip)*nbTransitions+T, return_inverse=True)
+        triples = np.stack((keys//nbTransitions//nbAtoms, keys//nbTransitions%nbAtoms, keys%nbTransitions))
+        self.hits += len(I)-triples.shape[1]
+        checks = np.empty(triples.shape[1], dtype=bool)
+        missing = []
+        for k,(i,ip,t) in enumerate(triples.T.tolist()):
+            check = self.entries.get((i, ip, t, inv))
+            if check is None:
+                missing.append(k)
+            else:
+                checks[k] = check
+                self.entries.move_to_end((i, ip, t, inv))
+        self.hits += triples.shape[1]-len(missing)
+        self.misses += len(missing)
+        if len(missing)>0:
+            if self.matrices is None or len(self.matrices[2])!=len(self.pool):
+                self.matrices = atomMatrices(self.pool, self.net.p)
+            i, ip, t = triples[:,missing]
+            checks[missing] = atomicImplicationBatch(self.net, self.matrices, i, ip, t, inv)
+            for k in missing:
+                self.entries[(*triples[:,k].tolist(), inv)] = bool(checks[k])
+                if len(self.entries) > self.size:
+                    self.entries.popitem(last=False)
+        return checks[index.ravel()]
+
+    def hitRate(self):
+        lookups = self.hits + self.misses
+        return self.hits/lookups if lookups>0 else 0
+
+    def printStats(self):
+        print("--Implication cache-------")
+        print("Lookups:", self.hits+self.misses)
+        print("Hits:", self.hits)
+        print("Misses:", self.misses)
+        print("Hit rate:", self.hitRate())
+        print("--------------------------")
+
+
 def clauseImplication(net: Net, phi: Clause, phip: Clause, t: Transition, inv=False):
     """
     Check clausal t-implication (explained in section 6 of [1]).
@@ -507,78 +836,55 @@ def checkLocallyClosedBiSeparator(net: Net, phi: Formula, msrc, mtgt):
 def checkLocallyClosedBiSeparatorWithSyndrome(net: Net, phi: Formula, msrc, mtgt, log=False):
     """
     Check in a given formula is a locally closed bi-separator for (msrc,mtgt), 
-    using the syndrome computed during generateLocallyClosedBiSeparator.
+    using the syndrome computed during generateLocallyClosedBiSeparator. The 
+    atomic implication checks of the syndromes are gathered for each 
+    direction, then checked in batches through an ImplicationCache.
 
     Args:
         net: the Petri net
         phi: the formula
         msrc: the source marking
         mtgt: the target marking
+        log: True will print the avancement and the cache statistics
 
     Return:
         bool: True iff phi is a locally closed bi-separator for (msrc,mtgt)
-        max_time: maximal time of atomic implication checks
+        max_time: maximal time of the batch of atomic implication checks of 
+            a direction
+        nb_atomic_check_performed: number of atomic implication checks 
+            performed (not found in the cache)
+        cache: the ImplicationCache
     """
     max_time = 0
-    total_time = 0
-    nb_atomic_check_performed = 0
+    cache = ImplicationCache(net, phi.pool)
 
-    return_value = [True, max_time, nb_atomic_check_performed]
+    valid = True
 
     if not phi.check(msrc, msrc) or not phi.check(mtgt, mtgt) or phi.check(msrc, mtgt):
-        return_value = [False, max_time, nb_atomic_check_performed]
-    
+        valid = False
 
     step = 1
-    step_avancement = 0
-    for t in net.transitions:
-        if log:
-            print(">Step "+str(step)+"/"+str(net.t*2))
-            step += 1
-            step_avancement = 1
-        for C in phi.clauses:
-            if log:
-                print(str(step_avancement)+"/"+str(len(phi.clauses)))
-                step_avancement += 1
-            j = C.forwardSyndrome[t.name][0]
-            Cp = phi.clauses[j]
-            for j in range(Cp.size):
-                psip_j = Cp.atoms[j]
-                i = C.forwardSyndrome[t.name][1][j]
-                psi_i = C.atoms[i]
-                start = time.time()
-                check = atomicImplication(net, psi_i, psip_j, t)
-                nb_atomic_check_performed += 1
-                stop = time.time()
-                max_time = max(max_time, stop-start)
-                total_time += stop-start
-                if not check:
-                    return_value = [False, max_time, nb_atomic_check_performed]
-    
-    for t in net.transitions:
-        if log:
-            print(">Step "+str(step)+"/"+str(net.t*2))
-            step += 1
-            step_avancement = 1
-        for C in phi.clauses:
+    for inv in (False, True):
+        # Gather the (atom, atom, transition) triples of the syndromes
+        I, Ip, T = [], [], []
+        for t in net.transitions:
             if log:
-                print(str(step_avancement)+"/"+str(len(phi.clauses)))
-                step_avancement += 1
-            j = C.backwardSyndrome[t.name][0]
-            Cp = phi.clauses[j]
-            for j in range(Cp.size):
-                psip_j = Cp.atoms[j]
-                i = C.backwardSyndrome[t.name][1][j]
-                psi_i = C.atoms[i]
-                start = time.time()
-                check = atomicImplication(net, psi_i, psip_j, t, inv=True)
-                nb_atomic_check_performed += 1
-                stop = time.time()
-                max_time = max(max_time, stop-start)
-                total_time += stop-start
-                if not check:
-                    return_value = [False, max_time, nb_atomic_check_performed]
-
-    return_value[1] = max_time
-    if return_value[0]: return True, max_time, nb_atomic_check_performed
-    else: return return_value
\ No newline at end of file
+                print(">Step "+str(step)+"/"+str(net.t*2))
+                step += 1
+            for C in phi.clauses:
+                j,atoms = C.backwardSyndrome[t.id] if inv else C.forwardSyndrome[t.id]
+                Cp = phi.clauses[j]
+                I.append(C.ids[atoms])
+                Ip.append(Cp.ids)
+                T.append(np.full(Cp.size, t.id))
+        if len(I)==0: continue
+        start = time.time()
+        checks = cache.impliesMany(np.concatenate(I), np.concatenate(Ip), np.concatenate(T), inv)
+        stop = time.time()
+        max_time = max(max_time, stop-start)
+        if not np.all(checks):
+            valid = False
+
+    nb_atomic_check_performed = cache.misses
+    if log: cache.printStats()
+    return valid, max_time, nb_atomic_check_performed, cache
\ No newline at end of file
@@ -26,24 +26,19 @@ def checkClauseUselessness(form: Formula, i):
     x = np.array([Real("x%i" % i) for i in range(n)])
     xp = np.array([Real("xp%i" % i) for i in range(n)])
 
-    andA = []
-    for atom in A.atoms:
-        if atom.strict:
-            andA.append(np.dot(atom.a,x)<np.dot(atom.ap,xp))
-        else:
-            andA.append(np.dot(atom.a,x)<=np.dot(atom.ap,xp))
-    AZ3 = And(andA)
-
-    orB = []
-    for clause in B:
-        andB = []
-        for atom in clause.atoms:
+    # Constraint of each atom of the pool, built once
+    constraints = dict() # key: atom id, value: z3 constraint
+    for clause in form.clauses:
+        for j in clause.ids.tolist():
+            if j in constraints: continue
+            atom = form.pool[j]
             if atom.strict:
-                andB.append(np.dot(atom.a,x)<np.dot(atom.ap,xp))
+                constraints[j] = atom.a.dot(x)<atom.ap.dot(xp)
             else:
-                andB.append(np.dot(atom.a,x)<=np.dot(atom.ap,xp))
-        orB.append(And(andB))
-    BZ3 = Or(orB)
+                constraints[j] = atom.a.dot(x)<=atom.ap.dot(xp)
+
+    AZ3 = And([constraints[j] for j in A.ids.tolist()])
+    BZ3 = Or([And([constraints[j] for j in clause.ids.tolist()]) for clause in B])
 
     cstrt = And(AZ3, Not(BZ3))
     s.add(simplify(cstrt))
@@ -0,0 +1,737 @@
+"""
+Backends for the linear feasibility problems solved by the algorithms.
+
+A LinearSystem is a conjunction of linear constraints A*x=b, A*x<=b and
+A*x<b (strict) over nonnegative or free real variables. The backend used
+for the whole run is chosen with setBackend:
+    - "z3": incremental Z3 solver over Real variables (exact)
+    - "highs": SciPy HiGHS LP solver on the CSR matrices, a floating point 
+      heuristic: strict constraints and supports are read up to a 
+      tolerance, so its verdicts are not certified (see HighsSystem)
+    - "rational": sparse simplex over fractions (exact, each check solved 
+      from scratch, for small and medium systems)
+"""
+
+from abc import ABC, abstractmethod
+from contextlib import nullcontext
+from fractions import Fraction
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from scipy.sparse import csr_matrix, vstack, hstack, identity
+from scipy.optimize import linprog
+from z3 import *
+from tasks.utilities import *
+
+HIGHS_TOLERANCE = 1e-7
+
+
+class LinearSystem(ABC):
+    """
+    Abstract class for systems of linear constraints. The constraints are 
+    kept as CSR blocks, so that any backend can rebuild the system.
+
+    Attributs:
+        n: number of variables
+        nonnegative: True iff the variables are nonnegative (else free)
+        blocks: list of constraints (A, b, sense), sense in "==","<=","<"
+        stack: number of blocks at each push
+        parametric: matrix A of the constraints A*x==b whose right-hand 
+            side b is given by setParameters (or None)
+        selectable: constraints (A, b, sense) whose rows are only enforced 
+            when selected (or None)
+        selected: bool array of the rows of selectable which are enforced
+    """
+
+    def __init__(self, n, nonnegative=True):
+        self.n = n
+        self.nonnegative = nonnegative
+        self.blocks = []
+        self.stack = []
+        self.parametric = None
+        self.selectable = None
+        self.selected = None
+        self._selectedBlock = None
+        self._point = None
+
+    def add(self, A, b, sense):
+        b = np.atleast_1d(np.asarray(b, dtype=float))
+        A = csr_matrix(A, shape=(len(b), self.n), dtype=float)
+        self.blocks.append((A, b, sense))
+
+    def addEq(self, A, b):
+        self.add(A, b, "==")
+
+    def addLe(self, A, b):
+        self.add(A, b, "<=")
+
+    def addLt(self, A, b):
+        self.add(A, b, "<")
+
+    def addParametricEq(self, A):
+        """
+        Declares the constraints A*x==b whose right-hand side b changes, 
+        so that a backend can encode A*x once for all the values of b.
+        """
+        self.parametric = csr_matrix(A, shape=(A.shape[0], self.n), dtype=float)
+
+    def setParameters(self, b):
+        """
+        Adds the constraints A*x==b, where A is given by addParametricEq 
+        (usually between push and pop, to change b afterwards).
+        """
+        self.addEq(self.parametric, b)
+
+    def addSelectable(self, A, b, sense):
+        """
+        Declares constraints A*x (sense) b whose rows are switched on and 
+        off by select, so that a backend can encode them once (no row is 
+        selected at first, and pop does not change the selection).
+        """
+        b = np.atleast_1d(np.asarray(b, dtype=float))
+        self.selectable = (csr_matrix(A, shape=(len(b), self.n), dtype=float), b, sense)
+        self.selected = np.zeros(len(b), dtype=bool)
+        self._selectedBlock = None
+
+    def select(self, rows):
+        """
+        Enforces exactly the given rows of the selectable constraints.
+        """
+        self.selected = np.zeros(len(self.selected), dtype=bool)
+        self.selected[np.asarray(rows, dtype=np.int64)] = True
+        self._selectedBlock = None
+
+    def activeBlocks(self):
+        """
+        Gives the blocks of the system, with the selected rows of the 
+        selectable constraints.
+        """
+        if self.selectable is None or not self.selected.any(): return self.blocks
+        if self._selectedBlock is None:
+            A, b, sense = self.selectable
+            rows = np.flatnonzero(self.selected)
+            self._selectedBlock = (A[rows], b[rows], sense)
+        return self.blocks+[self._selectedBlock]
+
+    def boundBlock(self, ids, sense):
+        """
+        Gives the block of the constraints x[i]>0 (sense "<", as -x[i]<0) 
+        or x[i]==0 (sense "==") for i in ids.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        sign = -1. if sense=="<" else 1.
+        A = csr_matrix((np.full(len(ids), sign), (np.arange(len(ids)), ids)), shape=(len(ids),self.n))
+        return A, np.zeros(len(ids)), sense
+
+    def addPositive(self, i):
+        """
+        Adds the constraint x[i]>0.
+        """
+        self.add(*self.boundBlock([i], "<"))
+
+    def fixZero(self, ids):
+        """
+        Adds the constraints x[i]==0 for i in ids.
+        """
+        if len(ids)==0: return
+        self.add(*self.boundBlock(ids, "=="))
+
+    def state(self):
+        """
+        Gives a picklable description of the system (without its stack),
+        from which systemFromState rebuilds it in another process.
+        """
+        return (type(self), self.n, self.nonnegative, list(self.activeBlocks()))
+
+    def push(self):
+        self.stack.append(len(self.blocks))
+
+    def pop(self):
+        del self.blocks[self.stack.pop():]
+
+    @abstractmethod
+    def check(self):
+        """
+        Checks if the system has a solution, and keeps it.
+
+        Return:
+            bool: True iff the system has a solution
+        """
+
+    def point(self, exact=False):
+        """
+        Gives the solution found by the last successful check.
+
+        Args:
+            exact: True to get Fraction values (exact for the exact 
+                backends, the float values otherwise)
+
+        Return:
+            x: float np.array, or np.array of Fraction if exact
+        """
+        if exact:
+            return np.array([Fraction(v) for v in self._point], dtype=object)
+        return np.asarray(self._point, dtype=float)
+
+    def maximalSupport(self):
+        """
+        Computes a solution whose support is maximal, with few LP solves:
+        each solve maximizes the sum of min(x,1) over the variables x not in
+        the support found so far, and the solutions found are averaged.
+
+        Return:
+            x: float np.array, or None if the system has no solution
+        """
+        covered = np.zeros(self.n, dtype=bool)
+        solution = np.zeros(self.n)
+        nb_sol = 0
+        while nb_sol==0 or not covered.all():
+            x = self.solveSlack(np.flatnonzero(~covered))
+            if x is None: break
+            if nb_sol>0 and not (x[~covered]>0).any(): break
+            nb_sol += 1
+            covered |= x>0
+            solution += x
+        if nb_sol==0: return None
+        return solution/nb_sol
+
+    @abstractmethod
+    def solveSlack(self, ids):
+        """
+        Maximizes the sum of min(x[i],1) for i in ids, with slack variables
+        s[i] such that 0<=s[i]<=1 and s[i]<=x[i].
+
+        Return:
+            x: float np.array, or None if the system has no solution
+        """
+
+
+class MatrixSystem(LinearSystem):
+    """
+    Abstract class for the backends which solve the stacked CSR blocks 
+    from scratch at each check.
+    """
+
+    def check(self):
+        self._point = self.solve(self.activeBlocks(), self.n, np.zeros(self.n))
+        return self._point is not None
+
+    def solveSlack(self, ids):
+        k = len(ids)
+        blocks = [(hstack([A, csr_matrix((A.shape[0],k))]).tocsr(), b, sense) for A,b,sense in self.activeBlocks()]
+        I = identity(k, format="csr")
+        zero = csr_matrix((k,self.n))
+        X = csr_matrix((np.ones(k), (np.arange(k), ids)), shape=(k,self.n))
+        blocks.append((hstack([-X, I]).tocsr(), np.zeros(k), "<="))
+        blocks.append((hstack([zero, I]).tocsr(), np.ones(k), "<="))
+        if not self.nonnegative:
+            blocks.append((hstack([zero, -I]).tocsr(), np.zeros(k), "<="))
+        c = np.concatenate((np.zeros(self.n), np.ones(k)))
+        x = self.solve(blocks, self.n+k, c)
+        return None if x is None else np.asarray(x[:self.n], dtype=float)
+
+    @abstractmethod
+    def solve(self, blocks, n, c):
+        """
+        Maximizes c*x over the solutions of a list of blocks.
+
+        Args:
+            blocks: list of constraints (A, b, sense)
+            n: number of variables
+            c: objective
+
+        Return:
+            x: np.array of float or Fraction, or None if there is no solution
+        """
+
+
+def stackBlocks(blocks, n, sense):
+    """
+    Stacks the constraints of a given sense.
+
+    Return:
+        A: CSR matrix of the constraints
+        b: right-hand side
+    """
+    blocks = [block for block in blocks if block[2]==sense]
+    if len(blocks)==0:
+        return csr_matrix((0,n)),np.zeros(0)
+    return csr_matrix(vstack([block[0] for block in blocks])),np.concatenate([block[1] for block in blocks])
+
+
+class Z3System(LinearSystem):
+    """
+    Linear system solved by an incremental Z3 solver.
+
+    Attributs:
+        solver: the Z3 solver
+        vars: np.array of Z3 Real variables
+        handles: declarations of the variables, to read the models
+        parameters: np.array of Z3 Real for the right-hand side of the 
+            parametric constraints
+        activations: np.array of Z3 Bool, one per selectable row
+        bounds: list of (ids, sense) given to addPositive and fixZero, 
+            whose blocks are only built by state
+        boundStack: number of bounds at each push
+    """
+
+    def __init__(self, n, nonnegative=True):
+        super().__init__(n, nonnegative)
+        self.solver = Solver()
+        self.vars = np.array([Real("x%i" % i) for i in range(n)])
+        self.handles = variableHandles(self.vars)
+        self.bounds = []
+        self.boundStack = []
+        self._model = None
+        if nonnegative:
+            self.solver.add([x>=0 for x in self.vars])
+
+    def add(self, A, b, sense):
+        super().add(A, b, sense)
+        A, b, sense = self.blocks[-1]
+        Ax = sparseDot(A, self.vars)
+        if sense=="==": self.solver.add([Ax[i]==b[i] for i in range(len(b))])
+        elif sense=="<=": self.solver.add([Ax[i]<=b[i] for i in range(len(b))])
+        else: self.solver.add([Ax[i]<b[i] for i in range(len(b))])
+
+    def addParametricEq(self, A):
+        # A*x==r is encoded once, setParameters only adds r==b
+        super().addParametricEq(A)
+        self.parameters = np.array([Real("r%i" % i) for i in range(A.shape[0])])
+        Ax = sparseDot(self.parametric, self.vars)
+        self.solver.add([Ax[i]==self.parameters[i] for i in range(len(Ax))])
+
+    def setParameters(self, b):
+        LinearSystem.add(self, self.parametric, b, "==")
+        b = self.blocks[-1][1]
+        self.solver.add([self.parameters[i]==b[i] for i in range(len(b))])
+
+    def addSelectable(self, A, b, sense):
+        # Row i is encoded once as Implies(a_i, row), and the selected rows 
+        # are enforced by passing their literals a_i as assumptions
+        super().addSelectable(A, b, sense)
+        A, b, sense = self.selectable
+        self.activations = np.array([Bool("a%i" % i) for i in range(len(b))])
+        Ax = sparseDot(A, self.vars)
+        if sense=="==": rows = [Ax[i]==b[i] for i in range(len(b))]
+        elif sense=="<=": rows = [Ax[i]<=b[i] for i in range(len(b))]
+        else: rows = [Ax[i]<b[i] for i in range(len(b))]
+        self.solver.add([Implies(self.activations[i], rows[i]) for i in range(len(b))])
+
+    def assumptions(self):
+        if self.selectable is None: return []
+        return self.activations[self.selected].tolist()
+
+    def addPositive(self, i):
+        # Asserted on the variable, without building a CSR block
+        self.bounds.append(([i], "<"))
+        self.solver.add(self.vars[i]>0)
+
+    def fixZero(self, ids):
+        if len(ids)==0: return
+        self.bounds.append((ids, "=="))
+        self.solver.add([self.vars[i]==0 for i in ids])
+
+    def state(self):
+        cls, n, nonnegative, blocks = super().state()
+        return (cls, n, nonnegative, blocks+[self.boundBlock(ids, sense) for ids, sense in self.bounds])
+
+    def push(self):
+        super().push()
+        self.boundStack.append(len(self.bounds))
+        self.solver.push()
+
+    def pop(self):
+        super().pop()
+        del self.bounds[self.boundStack.pop():]
+        self.solver.pop()
+
+    def check(self):
+        if self.solver.check(*self.assumptions()) != sat:
+            self._model = self._point = None
+            return False
+        self._model = self.solver.model()
+        self._point = modelToVector(self._model, self.vars, handles=self.handles)
+        return True
+
+    def point(self, exact=False):
+        if exact: return modelToVector(self._model, self.vars, True, self.handles)
+        return self._point
+
+    def solveSlack(self, ids):
+        opt = Optimize()
+        opt.add(self.solver.assertions())
+        opt.add(self.assumptions())
+        slack = [Real("slack%i" % i) for i in ids]
+        for i in range(len(ids)):
+            opt.add(slack[i]>=0, slack[i]<=1, slack[i]<=self.vars[ids[i]])
+        if len(slack)>0: opt.maximize(Sum(slack))
+        if opt.check() != sat: return None
+        return modelToVector(opt.model(), self.vars, handles=self.handles)
+
+
+class HighsSystem(MatrixSystem):
+    """
+    Linear system solved by the HiGHS LP solver of SciPy. Strict
+    constraints A*x<b are relaxed to A*x+tau<=b where tau in [0,1] is
+    maximized, and they hold iff tau>tolerance. The objective is then
+    maximized with tau kept above half of its maximum.
+
+    This backend is a heuristic, not a decision procedure: HiGHS solves 
+    up to its feasibility tolerance (set to tolerance), a strict system 
+    whose tau is at most tolerance is taken as infeasible, and the values 
+    of a solution at most tolerance are taken as zero, so that a support 
+    may lose variables. The verdicts built on these answers (supports of 
+    the fixpoints, separators) should be confirmed with an exact backend.
+
+    Attributs:
+        tolerance: the tolerance of the run (see setBackend)
+    """
+
+    def __init__(self, n, nonnegative=True):
+        super().__init__(n, nonnegative)
+        self.tolerance = highsTolerance
+
+    def solve(self, blocks, n, c):
+        A_eq, b_eq = stackBlocks(blocks, n, "==")
+        A_le, b_le = stackBlocks(blocks, n, "<=")
+        A_lt, b_lt = stackBlocks(blocks, n, "<")
+        bounds = [(0 if self.nonnegative else None, None)]*n
+        strict = A_lt.shape[0]>0
+        if strict:
+            A_eq = hstack([A_eq, csr_matrix((A_eq.shape[0],1))]).tocsr()
+            A_le = vstack([hstack([A_le, csr_matrix((A_le.shape[0],1))]), hstack([A_lt, csr_matrix(np.ones((A_lt.shape[0],1)))])]).tocsr()
+            b_le = np.concatenate((b_le, b_lt))
+            x = self.linprog(np.concatenate((np.zeros(n), [1])), A_eq, b_eq, A_le, b_le, bounds+[(0, 1)])
+            if x is None or x[-1]<=self.tolerance: return None
+            if not np.any(c): return x[:n]
+            x = self.linprog(np.concatenate((c, [0])), A_eq, b_eq, A_le, b_le, bounds+[(x[-1]/2, 1)])
+            return None if x is None else x[:n]
+        return self.linprog(c, A_eq, b_eq, A_le, b_le, bounds)
+
+    def linprog(self, c, A_eq, b_eq, A_le, b_le, bounds):
+        """
+        Maximizes c*x with HiGHS, the values at most tolerance (in absolute 
+        value) are rounded to zero.
+        """
+        result = linprog(-c, A_ub=A_le if A_le.shape[0]>0 else None, b_ub=b_le if A_le.shape[0]>0 else None,
+                         A_eq=A_eq if A_eq.shape[0]>0 else None, b_eq=b_eq if A_eq.shape[0]>0 else None,
+                         bounds=bounds, method="highs", options={"primal_feasibility_tolerance": self.tolerance})
+        if result.status != 0: return None
+        x = result.x
+        x[np.abs(x)<=self.tolerance] = 0
+        return x
+
+
+class RationalSystem(MatrixSystem):
+    """
+    Linear system solved by an exact sparse simplex over fractions (see 
+    rationalSimplex).
+    Strict constraints A*x<b are relaxed to A*x+tau<=b where tau in [0,1]
+    is maximized, and they hold iff tau>0. The objective is then maximized
+    with tau kept above half of its maximum.
+    """
+
+    def solve(self, blocks, n, c):
+        strict = any(block[2]=="<" for block in blocks)
+        tau = n
+        rows = []
+        for A, b, sense in blocks:
+            for i in range(A.shape[0]):
+                row = {int(A.indices[j]): Fraction(float(A.data[j])) for j in range(A.indptr[i], A.indptr[i+1])}
+                if sense=="<": row[tau] = Fraction(1)
+                rows.append((row, Fraction(float(b[i])), sense!="=="))
+        objective = {int(i): Fraction(float(c[i])) for i in np.flatnonzero(c)}
+        if strict:
+            rows.append(({tau: Fraction(1)}, Fraction(1), True))
+            x = rationalSimplex(n+1, self.nonnegative, rows, {tau: Fraction(1)})
+            if x is None or x[tau]<=0: return None
+            if len(objective)>0:
+                rows.append(({tau: Fraction(-1)}, -x[tau]/2, True))
+                x = rationalSimplex(n+1, self.nonnegative, rows, objective)
+        else:
+            x = rationalSimplex(n, self.nonnegative, rows, objective)
+        if x is None: return None
+        return np.array(x[:n], dtype=object)
+
+
+def rationalSimplex(n, nonnegative, rows, objective):
+    """
+    Maximizes a linear objective over a polyhedron with the two-phase
+    simplex method (Bland's rule), in exact arithmetic. The tableau is 
+    sparse: each row is a dictionary column->coefficient with the 
+    right-hand side at column -1, and the reduced costs are a row of the 
+    same form, updated by each pivot. The signs of the (normalized) 
+    fractions are read on their numerators.
+
+    Args:
+        n: number of variables
+        nonnegative: True iff the variables are nonnegative (else free)
+        rows: list of (dict index->coefficient, rhs, True iff <= else ==)
+        objective: dict index->coefficient
+
+    Return:
+        x: list of Fraction (an optimal solution, or a feasible one if the
+            objective is unbounded), or None if there is no solution
+    """
+    # Columns: x (or x+ and x- if free), then one slack per <= row, then 
+    # one artificial variable per row whose slack cannot start the basis
+    width = n if nonnegative else 2*n
+    tableau = []
+    basis = []
+    slack = width
+    for row, rhs, le in rows:
+        line = dict()
+        for j, a in row.items():
+            if a==0: continue
+            line[j] = a
+            if not nonnegative: line[n+j] = -a
+        if le:
+            line[slack] = Fraction(1)
+            slack += 1
+        if rhs<0:
+            line = {j: -a for j, a in line.items()}
+            rhs = -rhs
+        if rhs!=0: line[-1] = rhs
+        tableau.append(line)
+        basis.append(slack-1 if le and line[slack-1]==1 else None)
+    first_artificial = slack
+    artificial = first_artificial
+    for i in range(len(tableau)):
+        if basis[i] is None:
+            tableau[i][artificial] = Fraction(1)
+            basis[i] = artificial
+            artificial += 1
+
+    def pivot(r, col, reduced):
+        line = tableau[r]
+        a = line[col]
+        if a!=1: tableau[r] = line = {j: v/a for j, v in line.items()}
+        for other in tableau+[reduced]:
+            f = other.get(col)
+            if f is None or other is line: continue
+            for j, v in line.items():
+                w = other.get(j, 0)-f*v
+                if w.numerator==0: other.pop(j, None)
+                else: other[j] = w
+        basis[r] = col
+
+    def optimize(reduced):
+        # Maximizes with Bland's rule, returns False iff unbounded
+        while True:
+            col = min((j for j, v in reduced.items() if j>=0 and v.numerator>0), default=None)
+            if col is None: return True
+            best = None
+            for i, line in enumerate(tableau):
+                a = line.get(col)
+                if a is not None and a.numerator>0:
+                    ratio = line.get(-1, 0)/a
+                    if best is None or ratio<best[0] or (ratio==best[0] and basis[i]<basis[best[1]]):
+                        best = (ratio, i)
+            if best is None: return False
+            pivot(best[1], col, reduced)
+
+    # Phase 1: minimize the sum of the artificial variables, whose reduced 
+    # costs are the sums of the entries of their rows
+    reduced = dict()
+    for i, line in enumerate(tableau):
+        if basis[i]>=first_artificial:
+            for j, v in line.items():
+                if j<first_artificial: reduced[j] = reduced.get(j, 0)+v
+    reduced = {j: v for j, v in reduced.items() if v.numerator!=0}
+    optimize(reduced)
+    if any(line.get(-1, 0)!=0 for i, line in enumerate(tableau) if basis[i]>=first_artificial):
+        return None
+    # Artificial variables left in the basis are pivoted out, or their rows 
+    # are redundant, then the artificial columns are dropped
+    redundant = []
+    for i, line in enumerate(tableau):
+        if basis[i]>=first_artificial:
+            col = min((j for j in line if 0<=j<first_artificial), default=None)
+            if col is None: redundant.append(i)
+            else: pivot(i, col, dict())
+    for i in reversed(redundant):
+        del tableau[i], basis[i]
+    for i, line in enumerate(tableau):
+        tableau[i] = {j: v for j, v in line.items() if j<first_artificial}
+
+    # Phase 2: maximize the objective
+    cost = dict()
+    for j, a in objective.items():
+        if a==0: continue
+        cost[j] = a
+        if not nonnegative: cost[n+j] = -a
+    reduced = dict(cost)
+    for i, line in enumerate(tableau):
+        c = cost.get(basis[i])
+        if c is None: continue
+        for j, v in line.items():
+            w = reduced.get(j, 0)-c*v
+            if w.numerator==0: reduced.pop(j, None)
+            else: reduced[j] = w
+    optimize(reduced)
+
+    values = [Fraction(0)]*width
+    for i, line in enumerate(tableau):
+        if basis[i]<width: values[basis[i]] = line.get(-1, Fraction(0))
+    if nonnegative: return values
+    return [values[j]-values[n+j] for j in range(n)]
+
+
+def systemFromState(state):
+    """
+    Rebuilds a system from its description given by LinearSystem.state.
+    """
+    cls, n, nonnegative, blocks = state
+    system = cls(n, nonnegative)
+    for A, b, sense in blocks:
+        system.add(A, b, sense)
+    return system
+
+
+workerSystem = None
+workerFixed = None
+
+
+def initWorker(state):
+    # Each worker of the pool builds its own copy of the system once
+    global workerSystem, workerFixed
+    workerSystem = systemFromState(state)
+    workerFixed = np.zeros(workerSystem.n, dtype=bool)
+
+
+def workerChecks(ids, fixed):
+    # Fixes to zero the variables fixed since the previous task of the 
+    # worker, then runs the checks on its system
+    fixed = np.asarray(fixed, dtype=np.int64)
+    fixed = fixed[~workerFixed[fixed]]
+    workerSystem.fixZero(fixed)
+    workerFixed[fixed] = True
+    return positiveChecks(ids)
+
+
+def positiveChecks(ids, system=None):
+    """
+    Looks for a solution with x[i]>0 for each i in ids, skipping the
+    variables that are already positive in a previous solution.
+
+    Args:
+        ids: variable ids to check
+        system: the system (the one of the worker by default)
+
+    Return:
+        points: list of the solutions found
+    """
+    if system is None: system = workerSystem
+    covered = np.zeros(system.n, dtype=bool)
+    points = []
+    for i in ids:
+        if covered[i]: continue # already positive in a previous solution
+        system.push()
+        system.addPositive(i)
+        if system.check():
+            points.append(system.point())
+            covered |= points[-1]>0
+        system.pop()
+    return points
+
+
+class PositivePool:
+    """
+    Class for a process pool running positiveChecks on copies of a system 
+    for a whole fixpoint loop. The workers build their copy of the system 
+    once, when the pool starts, and then only receive the ids of the 
+    variables fixed to zero in the loop.
+
+    Attributs:
+        system: the system
+        workers: number of processes
+        executor: the ProcessPoolExecutor
+    """
+
+    def __init__(self, system, workers):
+        self.system = system
+        self.workers = workers
+        self.executor = ProcessPoolExecutor(max_workers=workers, initializer=initWorker, initargs=(system.state(),))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.executor.shutdown()
+
+    def positiveChecks(self, ids, fixed):
+        """
+        Runs positiveChecks on the pool, the ids being split into one 
+        chunk per worker.
+
+        Args:
+            ids: variable ids to check
+            fixed: ids of all the variables fixed to zero in the system 
+                since the pool started (each worker only adds the new ones)
+
+        Return:
+            points: list of the solutions found by all the workers
+        """
+        # A first solution, found locally, already covers most of the ids 
+        # (and its support is in the union of the supports of the others)
+        if not self.system.check(): return []
+        points = [self.system.point()]
+        ids = np.asarray(ids, dtype=np.int64)
+        ids = ids[~(points[0][ids]>0)]
+        chunks = [chunk for chunk in np.array_split(ids, self.workers) if len(chunk)>0]
+        if len(chunks)<=1:
+            return points+positiveChecks(ids, self.system)
+        fixed = np.asarray(fixed, dtype=np.int64).tolist()
+        for result in self.executor.map(workerChecks, [chunk.tolist() for chunk in chunks], [fixed]*len(chunks)):
+            points += result
+        return points
+
+
+def positivePool(system, workers):
+    """
+    Gives the context of a PositivePool for a system, or an empty context 
+    (with None) for a sequential run.
+
+    Args:
+        system: the system, with all its constraints but the ones of fixZero
+        workers: number of processes (None for a sequential run)
+    """
+    if workers is None: return nullcontext()
+    return PositivePool(system, workers)
+
+
+BACKENDS = {"z3": Z3System, "highs": HighsSystem, "rational": RationalSystem}
+backend = "z3"
+highsTolerance = HIGHS_TOLERANCE
+
+
+def setBackend(name, tolerance=HIGHS_TOLERANCE):
+    """
+    Chooses the backend of the linear systems for the run. The "highs" 
+    backend is a floating point heuristic (see HighsSystem), the others 
+    are exact.
+
+    Args:
+        name: "z3", "highs" or "rational"
+        tolerance: feasibility tolerance of the "highs" backend, below 
+            which strict constraints fail and values are taken as zero
+    """
+    global backend, highsTolerance
+    assert name in BACKENDS, "Error: unknown backend "+str(name)
+    assert tolerance>0, "Error: the tolerance must be positive"
+    backend = name
+    highsTolerance = tolerance
+
+
+def newSystem(n, nonnegative=True):
+    """
+    Creates an empty linear system with the current backend.
+
+    Args:
+        n: number of variables
+        nonnegative: True iff the variables are nonnegative (else free)
+
+    Return:
+        system: the LinearSystem
+    """
+    return BACKENDS[backend](n, nonnegative)
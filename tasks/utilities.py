@@ -1,12 +1,26 @@
+from fractions import Fraction
+import ctypes
 import numpy as np
 from scipy.sparse import csr_matrix
 from z3 import *
 from objects.Net import Net
 
 
+def realCoefficient(c, ctx=None):
+    """
+    Converts a float coefficient into an exact Z3 rational value, from its 
+    decimal form as RealVal does (0.1 gives 1/10, not its binary value).
+    """
+    c = float(c)
+    if c.is_integer(): return RealVal(int(c), ctx)
+    return RealVal(str(Fraction(str(c))), ctx)
+
+
 def sparseDot(A,v):
     """
-    Computes the matrix product A*v.
+    Computes the matrix product A*v. Each row is built as one n-ary Z3 sum 
+    straight from the CSR arrays, with the Z3 C API (the terms are already 
+    Real, so there is no coercion, per-term arithmetic or simplify).
 
     Args:
         A: a p*t matrix in CSR format
@@ -16,40 +30,90 @@ def sparseDot(A,v):
         Av: matrix product Av as np.array
     """
     p,t = A.shape
-    Av = np.array([RealVal(0) for i in range(p)])
-
-    currentIndPtr = 0
+    A = csr_matrix(A)
+    A.sum_duplicates()
+    indptr, indices, data = A.indptr.tolist(), A.indices.tolist(), A.data.tolist()
+    ctx = v[0].ctx if len(v)>0 else main_ctx()
+    ref = ctx.ref()
+
+    # Terms c*v[j] are shared between rows, v[j] itself is used for c=1
+    coefficients = dict()
+    terms = dict()
+    pair = (Ast*2)()
+    zero = RealVal(0, ctx)
+    Av = np.empty(p, dtype=object)
     for i in range(p):
-        sum = RealVal(0)
-        for j in range(A.indptr[currentIndPtr], A.indptr[currentIndPtr+1]):
-            sum += A.data[j]*v[A.indices[j]]
-        Av[i] = simplify(sum)
-        currentIndPtr += 1
-
+        row = []
+        for k in range(indptr[i], indptr[i+1]):
+            c, j = data[k], indices[k]
+            if c==0: continue
+            term = terms.get((c,j))
+            if term is None:
+                if c==1: term = v[j]
+                else:
+                    coefficient = coefficients.get(c)
+                    if coefficient is None: coefficient = coefficients[c] = realCoefficient(c, ctx)
+                    pair[0], pair[1] = coefficient.as_ast(), v[j].as_ast()
+                    term = ArithRef(Z3_mk_mul(ref, 2, pair), ctx)
+                terms[(c,j)] = term
+            row.append(term)
+        if len(row)==0: Av[i] = zero
+        elif len(row)==1: Av[i] = row[0]
+        else:
+            args = (Ast*len(row))(*[term.as_ast() for term in row])
+            Av[i] = ArithRef(Z3_mk_add(ref, len(row), args), ctx)
     return Av
 
-def modelToFloat(model, vars, char):
+def variableHandles(vars):
     """
-    Converts a Z3 model into a float numpy array.
+    Gives the Z3 declarations of variables, by which modelToVector reads 
+    their values (to be computed once per array of variables).
+    """
+    return [x.decl().ast for x in vars]
+
+
+def modelToVector(model, vars, exact=False, handles=None):
+    """
+    Reads the values of variables in a Z3 model, in one pass over the 
+    variables. The values are read as numerator/denominator pairs through 
+    the Z3 API, by variable handle, and the variables without value in the 
+    model are 0.
 
     Args:
         model: a Z3 model
-        vars: a np.array of the varaibles
+        vars: a np.array of Z3 Real variables
+        exact: True to get Fraction values instead of float values
+        handles: variableHandles(vars), if it is already computed
     
     Return:
-        modelFloat: np.array of float
-    """
-    n = len(vars)
-    modelFloat = np.zeros(n)
-    for d in model.decls():
-        if d.name()[0] == char:
-            id = int(d.name()[1:])
-            texts = model[d].as_string().split("/")
-            if len(texts)==1:
-                modelFloat[id] = float(texts[0])
-            else:
-                modelFloat[id] = float(texts[0])/float(texts[1])
-    return modelFloat
+        vect: np.array of float (correctly rounded), or of Fraction if exact
+    """
+    if handles is None: handles = variableHandles(vars)
+    ctx, ref = model.ctx.ref(), model.model
+    n = len(handles)
+    num = np.zeros(n, dtype=np.int64)
+    den = np.ones(n, dtype=np.int64)
+    big = dict() # values whose numerator or denominator exceeds int64
+    N, D = ctypes.c_longlong(), ctypes.c_longlong()
+    for i in range(n):
+        value = Z3_model_get_const_interp(ctx, ref, handles[i])
+        if not value: continue
+        if Z3_get_numeral_rational_int64(ctx, value, N, D):
+            num[i], den[i] = N.value, D.value
+        else:
+            big[i] = Fraction(int(Z3_get_numeral_string(ctx, Z3_get_numerator(ctx, value))),
+                              int(Z3_get_numeral_string(ctx, Z3_get_denominator(ctx, value))))
+
+    if exact:
+        vect = np.array([Fraction(a, b) for a,b in zip(num.tolist(), den.tolist())], dtype=object)
+        for i, value in big.items(): vect[i] = value
+        return vect
+    # The division of two integers below 2^53 is correctly rounded in float
+    vect = num/den
+    large = np.flatnonzero((np.abs(num)>2**53) | (den>2**53))
+    for i in large.tolist(): vect[i] = int(num[i])/int(den[i])
+    for i, value in big.items(): vect[i] = value.numerator/value.denominator
+    return vect
 
 
 def placeVectorToSet(net: Net, vectS):
@@ -0,0 +1,153 @@
+"""
+Regression checks of the atomic t-implication kernels of tasks/separators.py
+(the sparse atomicImplication, atomicImplicationBatch and ImplicationCache)
+against the original dense implementation, on random atoms of small nets.
+"""
+
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools.reader import createNet
+from tasks.separators import atomicImplication, atomicImplicationBatch, atomMatrices, ImplicationCache
+from objects.Formula import Atom, AtomPool, denseVector
+
+NETS = ["bad-case-5", "bad-case-10", "figure-1-esparza"]
+
+
+def denseAtomicImplication(net, psi, psip, t, inv=False):
+    """
+    Original dense check of atomic t-implication (section 6 of [1]), over
+    all the 2p entries of the atoms, used as reference.
+    """
+    psi_a, psi_ap = denseVector(psi.a), denseVector(psi.ap)
+    psip_a, psip_ap = denseVector(psip.a), denseVector(psip.ap)
+
+    # Return True if X empty
+    if psi.strict:
+        if all(psi_a>=0) and all(psi_ap<=0): return True
+    else:
+        ap_dot_delta_t_minus = np.dot(psi_ap, net.tVectorMinus(t))
+        check = ap_dot_delta_t_minus>=0
+        check |= ap_dot_delta_t_minus<0 and (not all(psi_a>=0) or not all(-psi_ap>=0))
+        if not check: return True
+
+    # If X not empty
+    if not inv:
+        a = np.concatenate((psi_a, -psi_ap))
+        ap = np.concatenate((psip_a, -psip_ap))
+        minus_bp = np.dot(ap, np.concatenate((np.zeros(net.p), net.tVector(t))))
+        l = np.concatenate((np.zeros(net.p), net.tVectorMinus(t)))
+    else:
+        a = np.concatenate((-psi_ap, psi_a))
+        ap = np.concatenate((-psip_ap, psip_a))
+        minus_bp = np.dot(ap, np.concatenate((np.zeros(net.p), -net.tVector(t))))
+        l = np.concatenate((np.zeros(net.p), net.tVectorPlus(t)))
+
+    lowerbound = 0
+    upperbound = None
+    for i in range(2*net.p):
+        if ap[i]>0 and a[i]<=0: return False
+        if a[i]>0 and ap[i]>0:
+            lowerbound = max(lowerbound, ap[i]/a[i])
+        elif a[i]<0 and ap[i]<=0:
+            upperbound = ap[i]/a[i] if upperbound is None else min(upperbound, ap[i]/a[i])
+    if upperbound is not None and lowerbound>upperbound: return False
+
+    alpha = np.dot(a, l)
+    beta = np.dot(ap, l)
+    if alpha==0:
+        if not psip.strict: return minus_bp<=-beta
+        elif not psi.strict: return minus_bp<-beta
+        else: return minus_bp<-beta or (minus_bp==-beta and (upperbound is None or upperbound>0))
+    L = (minus_bp+beta)/alpha
+    if not psip.strict:
+        return upperbound is None or max(lowerbound, L)<=upperbound
+    elif not psi.strict:
+        if L>lowerbound: return upperbound is None or L<upperbound
+        return upperbound is None or lowerbound<=upperbound
+    if L>lowerbound:
+        if upperbound is None or L<upperbound: return True
+    else:
+        if upperbound is None or lowerbound<=upperbound: return True
+    return upperbound>=L and L>=lowerbound and L>0
+
+
+def randomVector(rng, p):
+    """
+    Random atom vector of a random density, with fractional entries.
+    """
+    density = rng.choice([0.05, 0.2, 0.5, 1.0])
+    vect = np.where(rng.random(p)<density, rng.integers(-3, 4, p), 0).astype(float)
+    if rng.random()<0.3: vect /= rng.choice([3, 7])
+    return vect
+
+
+def randomPool(rng, p, size=40):
+    """
+    Pool of random atoms, including the special shapes ap=a, ap=-a and
+    strict atoms with ap=0.
+    """
+    pool = AtomPool()
+    for k in range(size):
+        a = randomVector(rng, p)
+        shape = rng.random()
+        if shape<0.2: ap = a.copy()
+        elif shape<0.4: ap = -a
+        elif shape<0.5: a, ap = -np.abs(a), np.zeros(p)
+        else: ap = randomVector(rng, p)
+        pool.add(Atom(a, ap, bool(rng.random()<0.5)))
+    return pool
+
+
+def randomTriples(rng, net, pool, n):
+    return rng.integers(0, len(pool), n), rng.integers(0, len(pool), n), rng.integers(0, net.t, n)
+
+
+def expectedChecks(net, pool, I, Ip, T, inv):
+    return np.array([denseAtomicImplication(net, pool[i], pool[ip], net.transitionList[t], inv)
+                     for i,ip,t in zip(I.tolist(), Ip.tolist(), T.tolist())], dtype=bool)
+
+
+def loadNets():
+    root = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "nets", "homemade")
+    return [createNet(os.path.join(root, name+".lola")) for name in NETS]
+
+
+def test_atomicImplication():
+    rng = np.random.default_rng(1)
+    for net in loadNets():
+        for round in range(5):
+            pool = randomPool(rng, net.p)
+            I, Ip, T = randomTriples(rng, net, pool, 1000)
+            for inv in (False, True):
+                checks = [atomicImplication(net, pool[i], pool[ip], net.transitionList[t], inv)
+                          for i,ip,t in zip(I.tolist(), Ip.tolist(), T.tolist())]
+                assert np.array_equal(checks, expectedChecks(net, pool, I, Ip, T, inv))
+
+
+def test_atomicImplicationBatch():
+    rng = np.random.default_rng(2)
+    for net in loadNets():
+        for round in range(5):
+            pool = randomPool(rng, net.p)
+            I, Ip, T = randomTriples(rng, net, pool, 2000)
+            for inv in (False, True):
+                checks = atomicImplicationBatch(net, atomMatrices(pool, net.p), I, Ip, T, inv)
+                assert np.array_equal(checks, expectedChecks(net, pool, I, Ip, T, inv))
+
+
+def test_implicationCache():
+    rng = np.random.default_rng(3)
+    for net in loadNets():
+        pool = randomPool(rng, net.p)
+        cache = ImplicationCache(net, pool, size=500)
+        for round in range(4):
+            I, Ip, T = randomTriples(rng, net, pool, 1000)
+            for inv in (False, True):
+                expected = expectedChecks(net, pool, I, Ip, T, inv)
+                assert np.array_equal(cache.impliesMany(I, Ip, T, inv), expected)
+                checks = [cache.implies(i, ip, net.transitionList[t], inv) for i,ip,t in zip(I[:100].tolist(), Ip[:100].tolist(), T[:100].tolist())]
+                assert np.array_equal(checks, expected[:100])
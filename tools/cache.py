@@ -0,0 +1,129 @@
+"""
+Compiled binary form of the parsed net files, keyed by content hash.
+
+A cache file is made of a magic string, the length of a JSON header, the
+header itself and the raw arrays, each one aligned on ALIGN bytes so that
+it can be memory-mapped instead of being read.
+"""
+
+import os
+import json
+import hashlib
+import numpy as np
+
+MAGIC = b"PNCACHE2"
+ALIGN = 64
+
+
+def contentDigest(*contents):
+    """
+    Computes the hash of the given contents.
+
+    Args:
+        contents: bytes or strings to hash
+
+    Return:
+        digest: hexadecimal sha1 digest
+    """
+    h = hashlib.sha1()
+    for content in contents:
+        if isinstance(content, str): content = content.encode()
+        h.update(content)
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def cachePath(path, digest, cache):
+    """
+    Gives the location of the compiled form of a file.
+
+    Args:
+        path: path of the source file
+        digest: content hash of the source file
+        cache: True to store it next to the source, or a cache directory
+
+    Return:
+        path of the compiled file
+    """
+    if cache is True:
+        return path + ".pnc"
+    os.makedirs(cache, exist_ok=True)
+    return os.path.join(cache, digest + ".pnc")
+
+
+def namesToArray(names):
+    """
+    Packs a list of names (without white space) into a byte array.
+    """
+    return np.frombuffer("\n".join(names).encode(), dtype=np.uint8)
+
+
+def arrayToNames(array):
+    """
+    Unpacks a list of names packed by namesToArray.
+    """
+    text = array.tobytes().decode()
+    return text.split("\n") if len(text)>0 else []
+
+
+def writeCache(path, digest, arrays):
+    """
+    Writes a compiled file.
+
+    Args:
+        path: path of the compiled file
+        digest: content hash of the source file
+        arrays: dictionary name->np.array
+    """
+    header = {"digest": digest, "arrays": dict()}
+    offset = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        arrays[name] = array
+        header["arrays"][name] = {"dtype": array.dtype.str, "shape": array.shape, "offset": offset}
+        offset += -(-array.nbytes//ALIGN)*ALIGN
+
+    text = json.dumps(header).encode()
+    start = -(-(len(MAGIC)+8+len(text))//ALIGN)*ALIGN
+    text += b" "*(start-len(MAGIC)-8-len(text))
+
+    temp = path + ".tmp%i" % os.getpid()
+    with open(temp, "wb") as file:
+        file.write(MAGIC)
+        file.write(len(text).to_bytes(8, "little"))
+        file.write(text)
+        for name, array in arrays.items():
+            file.seek(start+header["arrays"][name]["offset"])
+            file.write(array.tobytes())
+        file.truncate(start+offset)
+    os.replace(temp, path)
+
+
+def readCache(path, digest):
+    """
+    Memory-maps a compiled file.
+
+    Args:
+        path: path of the compiled file
+        digest: expected content hash of the source file
+
+    Return:
+        arrays: dictionary name->np.array, or None if the file is missing
+            or was compiled from another content
+    """
+    if not os.path.isfile(path): return None
+    with open(path, "rb") as file:
+        if file.read(len(MAGIC)) != MAGIC: return None
+        length = int.from_bytes(file.read(8), "little")
+        header = json.loads(file.read(length))
+    if header["digest"] != digest: return None
+
+    start = len(MAGIC)+8+length
+    arrays = dict()
+    for name, entry in header["arrays"].items():
+        shape = tuple(entry["shape"])
+        if np.prod(shape)==0:
+            arrays[name] = np.zeros(shape, dtype=entry["dtype"])
+        else:
+            arrays[name] = np.memmap(path, dtype=entry["dtype"], mode="r", offset=start+entry["offset"], shape=shape)
+    return arrays
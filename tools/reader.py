@@ -2,8 +2,14 @@
 Read a Petri Net file and create the corresponding Net object.
 """
 
+import re
 import numpy as np
+from scipy.sparse import csc_matrix
 from objects.Net import *
+from tools.cache import *
+
+LOLA_COMMENT = re.compile(r"\{[^{}]*\}")
+LOLA_SEPARATOR = re.compile(r"[\s,]+")
 
 def cleanLine(line):
     """
@@ -11,85 +17,167 @@ def cleanLine(line):
     """
     return line.replace(" ","").replace(";","").replace("\n","")
 
-def createNet(path):
+def readStatements(file):
     """
-    Creates a Petri net from a .lola file.
+    Streams the statements (text ended by a dot comma) of a .lola file, 
+    with {...} comments removed. A statement may span several lines.
 
     Args:
-        path: path of the .lola file
+        file: an opened .lola file
+
+    Return:
+        generator of the statements as lists of tokens
+    """
+    buffer = ""
+    for line in file:
+        buffer += line
+        if ";" not in line: continue
+        if "{" in buffer:
+            if buffer.count("{") > buffer.count("}"): continue
+            buffer = LOLA_COMMENT.sub(" ", buffer)
+        statements = buffer.split(";")
+        buffer = statements.pop()
+        for statement in statements:
+            tokens = statement.split(None, 2)
+            if tokens: yield tokens # skips empty statements (';;')
+    assert len(buffer.split())==0, "Error: unterminated statement '"+buffer.strip()+"'"
+
+def readNames(text):
+    """
+    Reads a list of names separated by commas and whitespaces (line breaks 
+    included).
+    """
+    return [name for name in LOLA_SEPARATOR.split(text) if name]
+
+def readArcs(text, placeIds, rows, weights):
+    """
+    Reads a list of 'name: weight' separated by commas, the whitespaces 
+    (line breaks included) being ignored.
+
+    Args:
+        text: the list as a string
+        placeIds: dictionary place.name->place.id
+        rows: list where the place ids are appended
+        weights: list where the weights are appended
+
+    Return:
+        int: number of arcs read
+    """
+    arcs = [arc.split(":") for arc in "".join(text.split()).split(",") if arc]
+    assert all(len(arc)==2 for arc in arcs), "Error: bad arc list '"+text.strip()+"'"
+    rows.extend([placeIds[arc[0]] for arc in arcs])
+    weights.extend([float(arc[1]) for arc in arcs])
+    return len(arcs)
+
+def netToArrays(net: Net):
+    """
+    Converts a net into the arrays of its compiled form, with the incoming 
+    and outgoing arcs as the CSC matrices kept by the net (with their index 
+    type), so that arraysToNet builds them on the memory-mapped arrays.
+
+    Args:
+        net: the Petri net
+
+    Return:
+        arrays: dictionary name->np.array
+    """
+    arrays = dict()
+    for key, A in (("pre", net.pre), ("post", net.post)):
+        arrays[key+"_indptr"] = A.indptr
+        arrays[key+"_indices"] = A.indices
+        arrays[key+"_data"] = A.data.astype(np.float64)
+    arrays["marking"] = np.asarray(net.marking)
+    arrays["place_names"] = namesToArray(net.placeNames)
+    arrays["transition_names"] = namesToArray(net.transitionNames)
+    return arrays
+
+
+def arraysToNet(name, arrays):
+    """
+    Creates a Petri net from the arrays of its compiled form. The CSC 
+    matrices of the arcs are built on the (memory-mapped) arrays without 
+    copying them.
+
+    Args:
+        name: name of the Petri net
+        arrays: dictionary name->np.array
 
     Return:
         net: the Petri net as a Net object
     """
-    name = path
-    p = 0
-    t = 0
-    places = []
-    transitions = set()
-    marking = np.zeros(p)
+    placeNames = arrayToNames(arrays["place_names"])
+    transitionNames = arrayToNames(arrays["transition_names"])
+    shape = (len(placeNames), len(transitionNames))
+    pre, post = [csc_matrix((arrays[key+"_data"], arrays[key+"_indices"], arrays[key+"_indptr"]), shape=shape) for key in ("pre", "post")]
+    marking = np.array(arrays["marking"])
+    return Net(name, placeNames, transitionNames, marking, pre, post)
 
-    placeIds = dict()
-    transitionIds = dict()
 
-    with open(path, "r") as file:
-        file.readline() #PLACE
+def createNet(path, cache=None):
+    """
+    Creates a Petri net from a .lola file. The file is streamed once and 
+    the arcs go straight into index arrays.
 
-        placeNames = cleanLine(file.readline()).split(",")
-        p = len(placeNames)
-        for i in range(p):
-            placeIds[placeNames[i]] = i
-        
-        file.readline() #\n
-        file.readline() #MARKING
-
-        placeTokens = cleanLine(file.readline()).split(",")
-        marking = np.zeros(p)
-        for text in placeTokens:
-            placeName = text.split(":")[0]
-            token = float(text.split(":")[1])
-            marking[placeIds[placeName]] = token
-        
-        places = [Place(placeIds[placeName], placeName, marking[placeIds[placeName]]) for placeName in placeNames]
-        
-        file.readline() #\n
+    Args:
+        path: path of the .lola file
+        cache: None to always parse the file, True to keep its compiled 
+            form next to it, or a cache directory
 
-        transitionLines = file.readlines()
-        transitionLines = [line for line in transitionLines if line != "\n"]
+    Return:
+        net: the Petri net as a Net object
+    """
+    if cache:
+        with open(path, "rb") as file:
+            digest = contentDigest(file.read())
+        arrays = readCache(cachePath(path, digest, cache), digest)
+        if arrays is not None: return arraysToNet(path, arrays)
 
-        t = int(len(transitionLines)/3)
-        for i in range(t):
-            transitionName = cleanLine(transitionLines[3*i][11:])
-            consume = cleanLine(transitionLines[3*i+1][8:]).split(",")
-            produce = cleanLine(transitionLines[3*i+2][8:]).split(",")
-            
-            inArcs = set()
-            for text in consume:
-                if len(text)>0:
-                    placeName = text.split(":")[0]
-                    weight = float(text.split(":")[1])
-                    inArcs.add(InArc(places[placeIds[placeName]], weight))
-
-            outArcs = set()
-            for text in produce:
-                if len(text)>0:
-                    placeName = text.split(":")[0]
-                    weight = float(text.split(":")[1])
-                    outArcs.add(OutArc(places[placeIds[placeName]], weight))
-            
-            transitionIds[transitionName] = i
-            transitions.add(Transition(i, transitionName, inArcs, outArcs))
+    placeNames = []
+    placeIds = dict()
+    transitionNames = []
+    markingRows, markingWeights = [], []
+    preRows, preCols, preWeights = [], [], []
+    postRows, postCols, postWeights = [], [], []
 
+    with open(path, "r") as file:
+        for statement in readStatements(file):
+            keyword = statement[0]
+            text = " ".join(statement[1:])
+            if keyword == "PLACE":
+                placeNames = readNames(text)
+                placeIds = {placeNames[i]: i for i in range(len(placeNames))}
+            elif keyword == "MARKING":
+                readArcs(text, placeIds, markingRows, markingWeights)
+            elif keyword == "TRANSITION":
+                assert len(statement)==3 and statement[2].startswith("CONSUME"), "Error: bad transition '"+text+"'"
+                transitionNames.append(statement[1])
+                n = readArcs(statement[2][7:], placeIds, preRows, preWeights)
+                preCols.extend([len(transitionNames)-1]*n)
+            elif keyword == "PRODUCE":
+                n = readArcs(text, placeIds, postRows, postWeights)
+                postCols.extend([len(transitionNames)-1]*n)
+            else:
+                assert False, "Error: unknown statement '"+keyword+"'"
 
-    return Net(name, places, transitions, marking, placeIds, transitionIds)
+    marking = np.zeros(len(placeNames))
+    marking[markingRows] = markingWeights
+    pre = (np.array(preRows, dtype=np.int64), np.array(preCols, dtype=np.int64), np.array(preWeights))
+    post = (np.array(postRows, dtype=np.int64), np.array(postCols, dtype=np.int64), np.array(postWeights))
+    net = Net.fromArcs(path, placeNames, transitionNames, marking, pre, post)
+    if cache:
+        writeCache(cachePath(path, digest, cache), digest, netToArrays(net))
+    return net
 
 
-def createMarking(net, path):
+def createMarking(net, path, cache=None):
     """
     Creates a marking from a .formula file.
 
     Args:
         net: the corresponding Petri net
         path: path of the .formula file
+        cache: None to always parse the file, True to keep its compiled 
+            form next to it, or a cache directory
 
     Return:
         marking: the marking as a np.array 
@@ -98,6 +186,11 @@ def createMarking(net, path):
     with open(path, "r") as file:
         formula = file.read()
 
+    if cache:
+        digest = contentDigest(formula, "\n".join(net.placeIds))
+        arrays = readCache(cachePath(path, digest, cache), digest)
+        if arrays is not None: return np.array(arrays["marking"])
+
     formula = formula.replace("AGEF","")
     formula = formula.replace("EF","")
     formula = formula.replace("AG","")
@@ -116,19 +209,40 @@ def createMarking(net, path):
         token = float(temp.split("=")[1])
         marking[net.placeIds[placeName]] = token
 
+    if cache:
+        writeCache(cachePath(path, digest, cache), digest, {"marking": marking})
     return marking
 
 
-def parsePetriFile(path):
-    name = path
+def parsePetriFile(path, cache=None):
+    """
+    Creates a Petri net and its bad markings from a .petri file.
+
+    Args:
+        path: path of the .petri file
+        cache: None to always parse the file, True to keep its compiled 
+            form next to it, or a cache directory
+
+    Return:
+        net: the Petri net as a Net object
+        bad_covers: list of markings to cover
+    """
+    if cache:
+        with open(path, "rb") as file:
+            digest = contentDigest(file.read())
+        arrays = readCache(cachePath(path, digest, cache), digest)
+        if arrays is not None:
+            return arraysToNet(path, arrays),list(np.array(arrays["bad_covers"]))
+
     p = 0
     t = 0
-    places = []
-    transitions = set()
+    placeNames = []
+    transitionNames = []
     marking = []
+    preRows, preCols = [], []
+    postRows, postCols = [], []
 
     placeIds = dict()
-    transitionIds = dict()
 
     bad_covers = []
 
@@ -145,7 +259,7 @@ def parsePetriFile(path):
                 line = line.replace(" ","")
                 p_name = line.split("=")[0]
                 p_token = int(line.split("=")[1])
-                places.append(Place(p, p_name, p_token))
+                placeNames.append(p_name)
                 marking.append(p_token)
                 placeIds[p_name] = p
                 p += 1
@@ -163,16 +277,15 @@ def parsePetriFile(path):
             preset_string = content[1].split("->")[0]
             postset_string = content[1].split("->")[1]
 
-            inArcs = set()
             for p_string in preset_string.split(","):
-                inArcs.add(InArc(places[placeIds[p_string]], 1))
+                preRows.append(placeIds[p_string])
+                preCols.append(t)
             
-            outArcs = set()
             for p_string in postset_string.split(","):
-                outArcs.add(InArc(places[placeIds[p_string]], 1))
+                postRows.append(placeIds[p_string])
+                postCols.append(t)
 
-            transitionIds[t_name] = t
-            transitions.add(Transition(t, t_name, inArcs, outArcs))
+            transitionNames.append(t_name)
             t += 1
             line = file.readline()
     
@@ -192,4 +305,12 @@ def parsePetriFile(path):
             line = file.readline() #\n
             line = file.readline()
 
-    return Net(name, places, transitions, np.array(marking), placeIds, transitionIds),bad_covers
\ No newline at end of file
+    marking = np.array(marking)
+    pre = (np.array(preRows, dtype=np.int64), np.array(preCols, dtype=np.int64), np.ones(len(preRows)))
+    post = (np.array(postRows, dtype=np.int64), np.array(postCols, dtype=np.int64), np.ones(len(postRows)))
+    net = Net.fromArcs(path, placeNames, transitionNames, marking, pre, post)
+    if cache:
+        arrays = netToArrays(net)
+        arrays["bad_covers"] = np.array(bad_covers).reshape((len(bad_covers), p))
+        writeCache(cachePath(path, digest, cache), digest, arrays)
+    return net,bad_covers
\ No newline at end of file